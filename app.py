@@ -1,38 +1,184 @@
 # app.py
-from fastapi import FastAPI, Depends, HTTPException, Query
+import time
+_import_started = time.perf_counter()  # 起動時間の計測（モジュール読み込み）
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from typing import List, Optional
-from datetime import datetime, timedelta
-from pydantic import BaseModel, Field
+from sqlalchemy import func, and_, extract
+from typing import Annotated, List, Optional
+from datetime import datetime, timedelta, date as date_type
+from pydantic import AfterValidator, BaseModel, Field
 from contextlib import asynccontextmanager
+import asyncio
 import os
 
-from db_control.connection import get_db, test_connection
-from db_control.models import ProductMaster, Transaction, TransactionDetail
+from db_control.connection import get_engine, SessionLocal, get_db, get_db_session, dispose_async_engine
+from db_control.startup import startup_timer, FirstRequestTimer
+from db_control.pool import sync_pool_metrics, async_pool_metrics, replica_pool_metrics, worker_count, primary_engine_count
+from db_control.sql_log import sql_stats
+from db_control.request_timing import REQUEST_TIMING_ENABLED, RequestTimingMiddleware, TimedRoute
+from db_control.health import DatabaseProber, HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT
+from db_control.replica import get_read_db, read_session_factory, replica_router, is_replica_session
+from db_control.models import ProductMaster, Transaction, TransactionDetail, SalesHourly
+from db_control.cache import (
+    product_cache,
+    product_to_dict,
+    MISSING,
+    PRODUCT_CACHE_MISS_TTL,
+    statistics_cache,
+    STATISTICS_CACHE_ENABLED,
+    naive_local,
+)
+from db_control.search_index import product_search_index, PRODUCT_SEARCH_INDEX_ENABLED
+from db_control.pagination import encode_cursor, decode_cursor, InvalidCursorError
+from db_control.purchase import (
+    find_missing_products,
+    insert_transaction,
+    delete_transaction as delete_transaction_record,
+)
+from db_control import rollups
+from db_control.topk import top_products_tracker, TOPK_TRACKER_ENABLED, TOPK_RESEED_SECONDS, TOPK_FULL_RESEED_SECONDS
+from db_control.analytics import analytics_snapshot, ANALYTICS_ENGINE_ENABLED, DIMENSIONS
+from db_control.export import iter_ndjson, iter_csv
+from db_control.statements import fetch_product_by_code, fetch_product_by_id, fetch_products_by_codes
+from db_control import distinct
+from db_control.group_commit import (
+    GroupCommitter,
+    PURCHASE_GROUP_COMMIT_ENABLED,
+    PURCHASE_GROUP_COMMIT_WINDOW_MS,
+    PURCHASE_GROUP_COMMIT_MAX_BATCH,
+)
 
 
 # ===== Lifespan イベントハンドラー =====
 
+# DB死活監視（/health はこの結果を返す）
+database_prober = DatabaseProber(get_engine, interval=HEALTH_PROBE_INTERVAL, timeout=HEALTH_PROBE_TIMEOUT)
+
+
+def _load_analytics_snapshot(session_factory=SessionLocal):
+    """分析スナップショットをDBから読み込む（増分、または全件の読み直し）"""
+    db = session_factory()
+    try:
+        analytics_snapshot.refresh(db, force=True)
+    finally:
+        db.close()
+
+
+def _seed_top_products_tracker(session_factory=SessionLocal, full=True):
+    """売れ筋サマリーをDBから初期化する（full=False は前回以降の取引の取り込みのみ）"""
+    db = session_factory()
+    try:
+        if full:
+            top_products_tracker.seed(db)
+        else:
+            top_products_tracker.catch_up(db)
+    finally:
+        db.close()
+
+
+def _build_product_search_index():
+    """商品検索インデックスをDBから構築する"""
+    db = SessionLocal()
+    try:
+        product_search_index.build(db)
+    finally:
+        db.close()
+
+
+async def _refresh_product_search_index():
+    """商品検索インデックスを構築し、他ワーカーの更新を取り込むため PRODUCT_SEARCH_INDEX_REFRESH 秒ごとに作り直す"""
+    while True:
+        try:
+            await asyncio.to_thread(_build_product_search_index)
+        except Exception as e:
+            print(f"⚠️  商品検索インデックスの構築に失敗しました: {e}")
+        # 構築に失敗して未構築の場合は間隔を空けずに再試行する
+        await asyncio.sleep(product_search_index.refresh_interval if product_search_index.ready else 10)
+
+
+async def _refresh_analytics_snapshot():
+    """分析スナップショットを ANALYTICS_REFRESH_SECONDS ごとに読み取りレプリカから更新する（リクエストでは更新しない）"""
+    while True:
+        await asyncio.sleep(analytics_snapshot.refresh_interval)
+        try:
+            await asyncio.to_thread(_load_analytics_snapshot, await read_session_factory())
+        except Exception as e:
+            print(f"⚠️  分析スナップショットの更新に失敗しました: {e}")
+
+
+async def _reseed_top_products_tracker():
+    """
+    他ワーカーの購入を取り込むため、TOPK_RESEED_SECONDS ごとに前回以降の取引を読み込む
+    他ワーカーでの削除を反映するため、TOPK_FULL_RESEED_SECONDS ごとにDBから作り直す（どちらも読み取りレプリカを使う）
+    """
+    while True:
+        await asyncio.sleep(TOPK_RESEED_SECONDS)
+        seeded_at = top_products_tracker.seeded_at
+        full = seeded_at is None or time.monotonic() - seeded_at >= TOPK_FULL_RESEED_SECONDS
+        try:
+            session_factory = await read_session_factory()
+            await asyncio.to_thread(_seed_top_products_tracker, session_factory, full)
+        except Exception as e:
+            print(f"⚠️  売れ筋サマリーの更新に失敗しました: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """アプリケーションのライフサイクル管理"""
     # 起動時処理
+    startup_timer.start_worker()
+    reseed_task = None
+    search_index_task = None
+    analytics_task = None
     print("=" * 60)
     print("🚀 POS System API 起動中...")
     print("=" * 60)
     
-    if test_connection():
+    # 最初の接続（エンジン作成を含む）をイベントループの外で行い、死活監視の初回結果とする
+    await database_prober.probe()
+    if database_prober.ok:
         print("✅ データベース接続確認完了")
     else:
-        print("⚠️  データベース接続に問題があります")
+        print(f"⚠️  データベース接続に問題があります: {database_prober.last_error}")
+    
+    if TOPK_TRACKER_ENABLED:
+        try:
+            await asyncio.to_thread(_seed_top_products_tracker, await read_session_factory())
+            print("✅ 売れ筋サマリー初期化完了")
+        except Exception as e:
+            print(f"⚠️  売れ筋サマリーの初期化に失敗しました: {e}")
+        if TOPK_RESEED_SECONDS > 0:
+            reseed_task = asyncio.create_task(_reseed_top_products_tracker())
+    
+    if PRODUCT_SEARCH_INDEX_ENABLED:
+        # 構築には商品数に比例した時間がかかるため起動を待たせない（完了までは LIKE 検索で応答）
+        search_index_task = asyncio.create_task(_refresh_product_search_index())
     
+    if ANALYTICS_ENGINE_ENABLED:
+        try:
+            await asyncio.to_thread(_load_analytics_snapshot, await read_session_factory())
+            print("✅ 分析スナップショット読み込み完了")
+        except Exception as e:
+            print(f"⚠️  分析スナップショットの読み込みに失敗しました: {e}")
+        analytics_task = asyncio.create_task(_refresh_analytics_snapshot())
+    
+    database_prober.start()
+    startup_timer.mark_since_worker_start("lifespan_startup")
+    print(f"⏱️  起動時間: {startup_timer.summary()}")
     print("=" * 60)
     
     yield
     
     # 終了時処理
+    for task in (reseed_task, search_index_task, analytics_task):
+        if task is not None:
+            task.cancel()
+    await database_prober.stop()
+    await purchase_committer.close()
+    await dispose_async_engine()
     print("=" * 60)
     print("👋 POS System API 終了")
     print("=" * 60)
@@ -72,6 +218,13 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+if REQUEST_TIMING_ENABLED:
+    # 検証・実行・シリアライズの境界を記録する（ルート登録より前に設定する）
+    app.router.route_class = TimedRoute
+
+# キーセットページネーションの次ページカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 # CORS設定
 app.add_middleware(
     CORSMiddleware,
@@ -79,11 +232,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+# 起動から最初のリクエスト応答までの時間を記録
+app.add_middleware(FirstRequestTimer)
+
+# リクエスト毎の処理時間の内訳（Server-Timing ヘッダー・構造化ログ、最も外側で計測）
+if REQUEST_TIMING_ENABLED:
+    app.add_middleware(RequestTimingMiddleware)
+
 
 # ===== Pydanticモデル（リクエスト/レスポンス） =====
 
+# クエリパラメータの日時（"...Z" などタイムゾーン付きの指定も、取引日時と同じ naive なローカル時刻に揃える）
+LocalDateTime = Annotated[datetime, AfterValidator(naive_local)]
+
 class ProductResponse(BaseModel):
     prd_id: int
     code: str
@@ -112,7 +276,7 @@ class TransactionResponse(BaseModel):
     store_cd: str
     pos_no: str
     total_amt: int
-    details: List[TransactionDetailResponse] = []
+    details: Optional[List[TransactionDetailResponse]] = None  # include_details=false のときは出力しない
     
     class Config:
         from_attributes = True
@@ -153,6 +317,14 @@ class SalesStatistics(BaseModel):
     total_items: int
 
 
+class TopProduct(BaseModel):
+    prd_id: int
+    prd_name: str
+    sales_count: int
+    total_sales: int
+    max_error: int = 0  # 販売数の最大誤差（過大評価のみ、売れ筋サマリー以外は 0）
+
+
 # ===== ヘルスチェック =====
 
 @app.get("/")
@@ -167,25 +339,144 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """ヘルスチェック"""
-    db_status = test_connection()
+    """ヘルスチェック（バックグラウンドの死活監視の最新結果を返す）"""
+    if database_prober.ok is None:
+        status, database = "starting", "unknown"
+    elif database_prober.ready:
+        status, database = "healthy", "connected"
+    else:
+        status, database = "unhealthy", "disconnected"
     return {
-        "status": "healthy" if db_status else "unhealthy",
-        "database": "connected" if db_status else "disconnected",
-        "timestamp": datetime.now().isoformat()
+        "status": status,
+        "database": database,
+        "timestamp": datetime.now().isoformat(),
+        "probe": database_prober.status()
     }
 
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: プロセスが応答できるか（DBの状態に関わらず 200）"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: リクエストを受け付けられるか（DBに接続できない場合は 503）"""
+    ready = database_prober.ready
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "timestamp": datetime.now().isoformat(),
+            "probe": database_prober.status()
+        }
+    )
+
+
+@app.get("/api/admin/pool-stats")
+async def get_pool_stats():
+    """
+    DB接続プールの統計情報（このワーカープロセスの値）
+    貸し出し中/待機中の接続数・オーバーフロー・貸し出し待ち時間・接続の作成/破棄数
+    """
+    pools = {"sync": sync_pool_metrics.stats()}
+    if async_pool_metrics.pool is not None:
+        pools["async"] = async_pool_metrics.stats()
+    if replica_pool_metrics.pool is not None:
+        pools["replica"] = replica_pool_metrics.stats()
+    return {
+        "pid": os.getpid(),
+        "workers": worker_count(),
+        "primary_engines": primary_engine_count(),
+        "pools": pools
+    }
+
+
+@app.get("/api/admin/startup")
+async def get_startup_report():
+    """起動時間の内訳（モジュール読み込み・エンジン作成・最初の接続・lifespan・最初のリクエスト、ミリ秒）"""
+    return startup_timer.report()
+
+
+@app.get("/api/admin/replica-status")
+async def get_replica_status():
+    """リードレプリカの遅延と読み取りの振り分け件数（このワーカープロセスの値）"""
+    return {"pid": os.getpid(), **replica_router.status()}
+
+
+@app.get("/api/admin/sql-stats")
+async def get_sql_stats(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = Query("total_ms", pattern="^(total_ms|count|average_ms|max_ms)$")
+):
+    """SQLのフィンガープリント毎の実行件数・実行時間（このワーカープロセスの値）"""
+    return {"pid": os.getpid(), **sql_stats.stats(limit, order_by)}
+
+
+@app.delete("/api/admin/sql-stats")
+async def reset_sql_stats():
+    """SQL実行時間の集計をリセットする"""
+    sql_stats.reset()
+    return {"message": "SQL統計をリセットしました"}
+
+
+# ===== DBアクセス =====
+
+async def run_db(db, fn, *args):
+    """
+    ORM処理を実行する
+    非同期セッション（DB_ASYNC=1）の場合は run_sync でイベントループを塞がずに実行し、
+    同期セッションの場合は従来どおりその場で実行する。
+    """
+    run_sync = getattr(db, "run_sync", None)  # AsyncSession のみが持つ
+    if run_sync is not None:
+        return await run_sync(fn, *args)
+    return fn(db, *args)
+
+
 # ===== 商品マスタ API =====
 
+def _decode_cursor_or_400(cursor: Optional[str]) -> dict:
+    """カーソルを復号する（空文字は先頭ページ、不正な場合は400）"""
+    if not cursor:
+        return {}
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/api/products", response_model=List[ProductResponse])
 async def get_products(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="次ページカーソル（X-Next-Cursor ヘッダーの値。指定時は skip を無視）"),
     db: Session = Depends(get_db)
 ):
     """商品一覧取得"""
+    seek = _decode_cursor_or_400(cursor)
+    try:
+        seek_offset = int(seek.get("o", 0))
+        seek_id = int(seek["id"]) if "id" in seek else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="不正なカーソルです")
+    if seek_offset < 0:
+        raise HTTPException(status_code=400, detail="不正なカーソルです")
+    
+    if search and PRODUCT_SEARCH_INDEX_ENABLED and product_search_index.ready:
+        # 検索インデックスでランキング順に検索（LIKE '%x%' の全件走査を回避）
+        # ランキング順はキーで表せないため、カーソルにはメモリ上の位置を持たせる
+        # （インデックスは lifespan のバックグラウンドタスクで構築し、構築完了までは LIKE 検索）
+        # 検索は CPU 処理のためスレッドで実行し、イベントループを止めない
+        start = seek_offset if cursor is not None else skip
+        products, has_more = await asyncio.to_thread(product_search_index.search, search, start, limit)
+        if has_more:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"o": start + limit})
+        return products
+    
     query = db.query(ProductMaster)
     
     if search:
@@ -194,16 +485,24 @@ async def get_products(
             (ProductMaster.name.like(f"%{search}%"))
         )
     
-    products = query.offset(skip).limit(limit).all()
+    query = query.order_by(ProductMaster.prd_id)
+    if cursor is not None:
+        # 主キーでシークする（OFFSET で読み捨てる行が発生しない）
+        if seek_id is not None:
+            query = query.filter(ProductMaster.prd_id > seek_id)
+    else:
+        query = query.offset(skip)
+    
+    products = query.limit(limit).all()
+    if len(products) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"id": products[-1].prd_id})
     return products
 
 
 @app.get("/api/products/{product_id}", response_model=ProductResponse)
 async def get_product(product_id: int, db: Session = Depends(get_db)):
     """商品詳細取得"""
-    product = db.query(ProductMaster).filter(
-        ProductMaster.prd_id == product_id
-    ).first()
+    product = fetch_product_by_id(db, product_id)
     
     if not product:
         raise HTTPException(status_code=404, detail="商品が見つかりません")
@@ -212,13 +511,11 @@ async def get_product(product_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/api/products/code/{code}", response_model=ProductResponse)
-async def get_product_by_code(code: str, db: Session = Depends(get_db)):
+async def get_product_by_code(code: str, db: Session = Depends(get_db_session)):
     """商品コードで商品取得（仕様書準拠）"""
-    product = db.query(ProductMaster).filter(
-        ProductMaster.code == code
-    ).first()
+    product = await _lookup_product_by_code(code, db)
     
-    if not product:
+    if product is None:
         raise HTTPException(status_code=404, detail="商品が見つかりません")
     
     return product
@@ -226,6 +523,25 @@ async def get_product_by_code(code: str, db: Session = Depends(get_db)):
 
 # ===== 仕様書準拠のAPIファンクション =====
 
+# 商品マスタ一括検索で1回に受け付けるコード数の上限
+PRODUCT_SEARCH_BATCH_MAX = int(os.getenv('PRODUCT_SEARCH_BATCH_MAX', '200'))
+
+async def _lookup_product_by_code(code: str, db) -> Optional[dict]:
+    """商品コードで商品を検索する（商品キャッシュ経由）"""
+    cached = product_cache.get(code)
+    if cached is not None:
+        return None if cached is MISSING else cached
+    
+    product = await run_db(db, fetch_product_by_code, code)
+    
+    if not product:
+        product_cache.set(code, MISSING, ttl=PRODUCT_CACHE_MISS_TTL)
+        return None
+    
+    product_cache.set(code, product)
+    return product
+
+
 class ProductSearchResponse(BaseModel):
     """商品マスタ検索の戻り値（仕様書準拠）"""
     prd_id: int  # 商品一意キー
@@ -237,26 +553,70 @@ class ProductSearchResponse(BaseModel):
 @app.get("/api/product-search", response_model=Optional[ProductSearchResponse])
 async def search_product_by_code(
     code: str = Query(..., description="商品コード"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_session)
 ):
     """
     商品マスタ検索（仕様書準拠）
     パラメータ: コード（商品コード）
     リターン: 商品情報（商品一意キー/商品コード/商品名称/商品単価）
     """
-    product = db.query(ProductMaster).filter(
-        ProductMaster.code == code
-    ).first()
+    product = await _lookup_product_by_code(code, db)
     
-    if not product:
+    if product is None:
         return None  # 仕様書の1-e1: 対象が見つからなかった場合はNULL情報を返す
     
-    return ProductSearchResponse(
-        prd_id=product.prd_id,
-        code=product.code,
-        name=product.name,
-        price=product.price
-    )
+    return ProductSearchResponse(**product)
+
+
+class ProductSearchBatchRequest(BaseModel):
+    """商品マスタ一括検索リクエスト"""
+    codes: List[str] = Field(..., max_length=PRODUCT_SEARCH_BATCH_MAX, description="商品コードのリスト")
+
+
+@app.post("/api/product-search/batch", response_model=List[Optional[ProductSearchResponse]])
+async def search_products_by_codes(
+    request: ProductSearchBatchRequest,
+    db: Session = Depends(get_db_session)
+):
+    """
+    商品マスタ一括検索
+    パラメータ: 商品コードのリスト（最大 PRODUCT_SEARCH_BATCH_MAX 件）
+    リターン: 入力順の商品情報リスト（見つからなかったコードはNULL）
+    """
+    found = {}
+    missing_codes = set()
+    for code in request.codes:
+        cached = product_cache.get(code)
+        if cached is None:
+            missing_codes.add(code)
+        elif cached is not MISSING:
+            found[code] = cached
+    
+    # キャッシュに無いコードは IN (...) で1回だけ問い合わせる
+    if missing_codes:
+        products = await run_db(db, fetch_products_by_codes, missing_codes)
+        for product in products:
+            product_cache.set(product["code"], product)
+            found[product["code"]] = product
+        for code in missing_codes - found.keys():
+            product_cache.set(code, MISSING, ttl=PRODUCT_CACHE_MISS_TTL)
+    
+    return [
+        ProductSearchResponse(**found[code]) if code in found else None
+        for code in request.codes
+    ]
+
+
+@app.get("/api/product-cache/stats")
+async def get_product_cache_stats():
+    """商品キャッシュの統計情報（ヒット/ミス/追い出し件数）"""
+    return product_cache.stats()
+
+
+@app.get("/api/product-search-index/stats")
+async def get_product_search_index_stats():
+    """商品検索インデックスの統計情報"""
+    return product_search_index.stats()
 
 
 @app.post("/api/products", response_model=ProductResponse)
@@ -279,6 +639,8 @@ async def create_product(
     db.add(product)
     db.commit()
     db.refresh(product)
+    product_cache.set(product.code, product_to_dict(product))
+    product_search_index.upsert(product_to_dict(product))
     
     return product
 
@@ -305,6 +667,8 @@ async def update_product(
     
     db.commit()
     db.refresh(product)
+    product_cache.set(product.code, product_to_dict(product))
+    product_search_index.upsert(product_to_dict(product))
     
     return product
 
@@ -319,25 +683,114 @@ async def delete_product(product_id: int, db: Session = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="商品が見つかりません")
     
+    code = product.code
     db.delete(product)
     db.commit()
+    product_cache.invalidate(code)
+    product_search_index.remove(product_id)
     
     return {"message": "商品を削除しました", "prd_id": product_id}
 
 
 # ===== 取引 API =====
 
-@app.get("/api/transactions", response_model=List[TransactionResponse])
+# 一覧・詳細レスポンスに使う列（ORMオブジェクトではなく列を射影して取得する）
+TRANSACTION_COLUMNS = (
+    Transaction.trd_id,
+    Transaction.datetime,
+    Transaction.emp_cd,
+    Transaction.store_cd,
+    Transaction.pos_no,
+    Transaction.total_amt,
+)
+
+DETAIL_COLUMNS = (
+    TransactionDetail.trd_id,
+    TransactionDetail.dtl_id,
+    TransactionDetail.prd_id,
+    TransactionDetail.prd_code,
+    TransactionDetail.prd_name,
+    TransactionDetail.prd_price,
+)
+
+
+def _attach_details(db: Session, transactions: List[dict]) -> None:
+    """取引（辞書）のリストに明細を1クエリでまとめて取得して付与する（N+1の回避）"""
+    by_id = {t["trd_id"]: t for t in transactions}
+    for t in transactions:
+        t["details"] = []
+    if not by_id:
+        return
+    
+    rows = db.query(*DETAIL_COLUMNS).filter(
+        TransactionDetail.trd_id.in_(by_id.keys())
+    ).order_by(TransactionDetail.trd_id, TransactionDetail.dtl_id).all()
+    for row in rows:
+        by_id[row.trd_id]["details"].append(row._asdict())
+
+
+def _record_transaction(transaction: dict, sign: int = 1) -> None:
+    """
+    コミット済みの取引をプロセス内の集計（売れ筋サマリー）へ反映する
+    取引はコミット済みのため、ここでの失敗はログのみとし呼び出し元（購入の成否）へ伝えない
+    """
+    try:
+        if TOPK_TRACKER_ENABLED:
+            top_products_tracker.record(transaction, sign)
+        if sign < 0:
+            analytics_snapshot.forget(transaction["trd_id"])
+        if STATISTICS_CACHE_ENABLED:
+            statistics_cache.invalidate(transaction["datetime"], transaction["store_cd"])
+    except Exception as e:
+        print(f"⚠️  取引 {transaction.get('trd_id')} の集計反映に失敗しました: {e}")
+
+
+# 購入のグループコミット（PURCHASE_GROUP_COMMIT=1 のときのみ使用）
+purchase_committer = GroupCommitter(
+    SessionLocal,
+    window_ms=PURCHASE_GROUP_COMMIT_WINDOW_MS,
+    max_batch=PURCHASE_GROUP_COMMIT_MAX_BATCH
+)
+
+@app.get("/api/transactions", response_model=List[TransactionResponse], response_model_exclude_none=True)
 async def get_transactions(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
     store_cd: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="次ページカーソル（X-Next-Cursor ヘッダーの値。指定時は skip を無視）"),
+    include_details: bool = Query(True, description="明細を含めるか（False でヘッダーのみ）"),
+    db: Session = Depends(get_read_db)
 ):
     """取引一覧取得"""
-    query = db.query(Transaction)
+    seek = _decode_cursor_or_400(cursor)
+    last = None
+    if "dt" in seek:
+        # (datetime, trd_id) でシークする（ix_transactions_datetime を範囲走査）
+        try:
+            last = (datetime.fromisoformat(seek["dt"]), int(seek["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="不正なカーソルです")
+    
+    transactions = await run_db(
+        db, _list_transactions,
+        None if cursor is not None else skip, limit, start_date, end_date, store_cd, last, include_details
+    )
+    if len(transactions) == limit:
+        last_row = transactions[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({
+            "dt": last_row["datetime"].isoformat(),
+            "id": last_row["trd_id"],
+        })
+    
+    return transactions
+
+
+def _list_transactions(db: Session, skip, limit, start_date, end_date, store_cd, last, include_details) -> List[dict]:
+    """取引一覧の取得本体（skip が None の場合は last = (datetime, trd_id) より後ろをシークする）"""
+    query = db.query(*TRANSACTION_COLUMNS)
     
     if start_date:
         query = query.filter(Transaction.datetime >= start_date)
@@ -346,23 +799,72 @@ async def get_transactions(
     if store_cd:
         query = query.filter(Transaction.store_cd == store_cd)
     
-    transactions = query.order_by(
-        Transaction.datetime.desc()
-    ).offset(skip).limit(limit).all()
+    if last is not None:
+        last_dt, last_id = last
+        query = query.filter(
+            (Transaction.datetime < last_dt) |
+            and_(Transaction.datetime == last_dt, Transaction.trd_id < last_id)
+        )
+    
+    query = query.order_by(
+        Transaction.datetime.desc(),
+        Transaction.trd_id.desc()
+    )
+    if skip is not None:
+        query = query.offset(skip)
     
+    transactions = [row._asdict() for row in query.limit(limit).all()]
+    if include_details:
+        _attach_details(db, transactions)
     return transactions
 
 
-@app.get("/api/transactions/{transaction_id}", response_model=TransactionResponse)
-async def get_transaction(transaction_id: int, db: Session = Depends(get_db)):
+@app.get("/api/transactions/export")
+async def export_transactions(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="出力形式（ndjson / csv）"),
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None
+):
+    """
+    取引履歴エクスポート（ストリーミング）
+    ndjson: 1行1取引（明細を details に含む）
+    csv: 1行1明細（取引ヘッダー列を含む）
+    """
+    session_factory = await read_session_factory(request=request)
+    if format == "csv":
+        body = iter_csv(session_factory, start_date, end_date, store_cd)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = iter_ndjson(session_factory, start_date, end_date, store_cd)
+        media_type = "application/x-ndjson"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    )
+
+
+@app.get("/api/transactions/{transaction_id}", response_model=TransactionResponse, response_model_exclude_none=True)
+async def get_transaction(
+    transaction_id: int,
+    include_details: bool = Query(True, description="明細を含めるか（False でヘッダーのみ）"),
+    db: Session = Depends(get_db)
+):
     """取引詳細取得"""
-    transaction = db.query(Transaction).filter(
+    transaction = db.query(*TRANSACTION_COLUMNS).filter(
         Transaction.trd_id == transaction_id
     ).first()
     
     if not transaction:
         raise HTTPException(status_code=404, detail="取引が見つかりません")
     
+    transaction = transaction._asdict()
+    if include_details:
+        _attach_details(db, [transaction])
+    
     return transaction
 
 
@@ -375,48 +877,27 @@ async def create_transaction(
     if not transaction_data.details:
         raise HTTPException(status_code=400, detail="明細が必要です")
     
-    # 取引作成
-    transaction = Transaction(
-        datetime=datetime.now(),
+    details = [d.model_dump() for d in transaction_data.details]
+    
+    # 商品存在チェック（全明細を1クエリで確認）
+    missing = find_missing_products(db, [d["prd_id"] for d in details])
+    if missing:
+        missing_id = next(d["prd_id"] for d in details if d["prd_id"] in missing)
+        raise HTTPException(
+            status_code=404,
+            detail=f"商品ID {missing_id} が見つかりません"
+        )
+    
+    # 取引・明細を登録（明細は複数行INSERTで一括登録）
+    transaction = insert_transaction(
+        db,
         emp_cd=transaction_data.emp_cd,
         store_cd=transaction_data.store_cd,
         pos_no=transaction_data.pos_no,
-        total_amt=0
+        details=details
     )
-    db.add(transaction)
-    db.flush()
-    
-    # 明細追加
-    total_amount = 0
-    for idx, detail_data in enumerate(transaction_data.details, start=1):
-        # 商品存在チェック
-        product = db.query(ProductMaster).filter(
-            ProductMaster.prd_id == detail_data.prd_id
-        ).first()
-        
-        if not product:
-            db.rollback()
-            raise HTTPException(
-                status_code=404,
-                detail=f"商品ID {detail_data.prd_id} が見つかりません"
-            )
-        
-        detail = TransactionDetail(
-            trd_id=transaction.trd_id,
-            dtl_id=idx,
-            prd_id=detail_data.prd_id,
-            prd_code=detail_data.prd_code,
-            prd_name=detail_data.prd_name,
-            prd_price=detail_data.prd_price
-        )
-        db.add(detail)
-        total_amount += detail_data.prd_price
-    
-    # 合計金額更新
-    transaction.total_amt = total_amount
-    
     db.commit()
-    db.refresh(transaction)
+    _record_transaction(transaction)
     
     return transaction
 
@@ -424,136 +905,451 @@ async def create_transaction(
 @app.post("/api/purchase", response_model=PurchaseResponse)
 async def purchase(
     purchase_data: PurchaseRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_session)
 ):
     """
     購入（仕様書準拠）
     パラメータ: レジ担当者コード、店舗コード、POS機ID、商品リスト
     リターン: 成否（True/False）、合計金額
     """
+    if not purchase_data.products:
+        return PurchaseResponse(success=False, total_amount=0)
+    
+    if PURCHASE_GROUP_COMMIT_ENABLED:
+        # 同時に届いた購入とまとめて1トランザクションで書き込む
+        transaction = await purchase_committer.submit(_purchase_values(purchase_data))
+        if transaction is None:
+            return PurchaseResponse(success=False, total_amount=0)
+        _record_transaction(transaction)
+        return PurchaseResponse(success=True, total_amount=transaction["total_amt"])
+    
+    return await run_db(db, _purchase, purchase_data)
+
+
+def _purchase_values(purchase_data: PurchaseRequest) -> dict:
+    """購入リクエストを取引登録用の値に変換する"""
+    return {
+        "emp_cd": purchase_data.emp_cd if purchase_data.emp_cd else "9999999999",
+        "store_cd": "30",  # 固定値
+        "pos_no": "90",    # 固定値（モバイルPOS）
+        "details": [p.model_dump() for p in purchase_data.products],
+    }
+
+
+def _purchase(db: Session, purchase_data: PurchaseRequest) -> PurchaseResponse:
+    """購入処理本体（1取引を登録してコミットする）"""
     try:
-        if not purchase_data.products:
+        values = _purchase_values(purchase_data)
+        
+        # 商品存在チェック（全明細を1クエリで確認）
+        if find_missing_products(db, [d["prd_id"] for d in values["details"]]):
             return PurchaseResponse(success=False, total_amount=0)
         
         # 1-1: 取引テーブルへ登録する
-        transaction = Transaction(
-            datetime=datetime.now(),
-            emp_cd=purchase_data.emp_cd if purchase_data.emp_cd else "9999999999",
-            store_cd="30",  # 固定値
-            pos_no="90",    # 固定値（モバイルPOS）
-            total_amt=0
-        )
-        db.add(transaction)
-        db.flush()  # 取引一意キーを取得するため
-        
-        # 1-2: 取引明細へ登録する
-        total_amount = 0
-        for idx, product_data in enumerate(purchase_data.products, start=1):
-            # 商品存在チェック
-            product = db.query(ProductMaster).filter(
-                ProductMaster.prd_id == product_data.prd_id
-            ).first()
-            
-            if not product:
-                db.rollback()
-                return PurchaseResponse(success=False, total_amount=0)
-            
-            detail = TransactionDetail(
-                trd_id=transaction.trd_id,
-                dtl_id=idx,
-                prd_id=product_data.prd_id,
-                prd_code=product_data.prd_code,
-                prd_name=product_data.prd_name,
-                prd_price=product_data.prd_price
-            )
-            db.add(detail)
-            total_amount += product_data.prd_price
-        
+        # 1-2: 取引明細へ登録する（複数行INSERTで一括登録）
         # 1-3: 合計を計算する（V_合計金額）
-        # 1-4: 取引テーブルを更新する
-        transaction.total_amt = total_amount
+        # 1-4: 取引テーブルを更新する（合計は事前計算してINSERT時に設定）
+        transaction = insert_transaction(db, **values)
         
         db.commit()
         
-        # 1-5: 合計金額をフロントへ返す
-        return PurchaseResponse(success=True, total_amount=total_amount)
-        
     except Exception as e:
         db.rollback()
         print(f"購入処理エラー: {e}")
         return PurchaseResponse(success=False, total_amount=0)
+    
+    # コミット後の集計反映（失敗しても購入は成功として返す）
+    _record_transaction(transaction)
+    
+    # 1-5: 合計金額をフロントへ返す
+    return PurchaseResponse(success=True, total_amount=transaction["total_amt"])
+
+
+@app.get("/api/purchase/group-commit/stats")
+async def get_group_commit_stats():
+    """購入グループコミットの統計情報"""
+    return {"enabled": PURCHASE_GROUP_COMMIT_ENABLED, **purchase_committer.stats()}
+
+
+@app.get("/api/statistics/top-products/tracker/stats")
+async def get_top_products_tracker_stats():
+    """売れ筋サマリーの統計情報"""
+    return {"enabled": TOPK_TRACKER_ENABLED, **top_products_tracker.stats()}
 
 
 @app.delete("/api/transactions/{transaction_id}")
 async def delete_transaction(transaction_id: int, db: Session = Depends(get_db)):
     """取引削除"""
-    transaction = db.query(Transaction).filter(
-        Transaction.trd_id == transaction_id
-    ).first()
+    transaction = delete_transaction_record(db, transaction_id)
     
-    if not transaction:
+    if transaction is None:
         raise HTTPException(status_code=404, detail="取引が見つかりません")
     
-    db.delete(transaction)
     db.commit()
+    _record_transaction(transaction, sign=-1)
     
     return {"message": "取引を削除しました", "trd_id": transaction_id}
 
 
 # ===== 統計・分析 API =====
 
+def _statistics_as_of(db, started):
+    """
+    集計結果が反映しているデータの鮮度（time.monotonic()）
+    レプリカは許容遅延、分析スナップショットは最終更新時刻の分だけ古い可能性がある
+    """
+    as_of = started
+    if is_replica_session(db):
+        as_of -= replica_router.max_lag_seconds
+    if ANALYTICS_ENGINE_ENABLED and analytics_snapshot.ready:
+        as_of = min(as_of, analytics_snapshot.refreshed_at)
+    return as_of
+
+
+async def _cached_statistics(endpoint, key, start, end, store_cd, db, compute):
+    """
+    統計APIのレスポンスキャッシュ（STATISTICS_CACHE=1 のとき）
+    key は正規化済みのクエリパラメータ、start〜end・store_cd は無効化判定に使う範囲
+    集計元（スナップショット・レプリカ）がこのワーカーでの直近の更新を含まない場合はキャッシュしない
+    """
+    if not STATISTICS_CACHE_ENABLED:
+        return await compute()
+    
+    value = statistics_cache.get(endpoint, key)
+    if value is None:
+        started = time.monotonic()
+        value = await compute()
+        statistics_cache.set(endpoint, key, value, start, end, store_cd, as_of=_statistics_as_of(db, started))
+    return value
+
+
+@app.get("/api/statistics/cache/stats")
+async def get_statistics_cache_stats():
+    """統計APIレスポンスキャッシュのエンドポイント毎のヒット率"""
+    return {
+        "enabled": STATISTICS_CACHE_ENABLED,
+        "stale_skips": statistics_cache.stale_skips,
+        "endpoints": statistics_cache.stats(),
+    }
+
+
 @app.get("/api/statistics/sales", response_model=SalesStatistics)
 async def get_sales_statistics(
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
     store_cd: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """売上統計取得"""
-    query = db.query(
-        func.count(Transaction.trd_id).label('count'),
-        func.sum(Transaction.total_amt).label('total'),
-        func.avg(Transaction.total_amt).label('average')
+    return await _cached_statistics(
+        "sales", (start_date, end_date, store_cd), start_date, end_date, store_cd, db,
+        lambda: run_db(db, _sales_statistics, start_date, end_date, store_cd)
     )
+
+
+def _sales_statistics(
+    db: Session,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    store_cd: Optional[str]
+) -> SalesStatistics:
+    if ANALYTICS_ENGINE_ENABLED and analytics_snapshot.ready:
+        # 列指向スナップショットから応答（更新はバックグラウンドタスク）
+        totals = analytics_snapshot.sales(start_date, end_date, store_cd)
+        return SalesStatistics(
+            total_transactions=totals["count"],
+            total_sales=totals["total"],
+            average_sale=totals["average"],
+            total_items=totals["items"]
+        )
     
-    if start_date:
-        query = query.filter(Transaction.datetime >= start_date)
-    if end_date:
-        query = query.filter(Transaction.datetime <= end_date)
-    if store_cd:
-        query = query.filter(Transaction.store_cd == store_cd)
+    rollup_range = rollups.rollup_range(start_date, end_date) if rollups.SALES_ROLLUPS_ENABLED else None
+    if rollup_range is not None:
+        # 集計テーブルから応答（期間の長さにのみ比例）
+        totals = rollups.sales_totals(db, *rollup_range, store_cd=store_cd)
+        return SalesStatistics(
+            total_transactions=totals["count"],
+            total_sales=totals["total"],
+            average_sale=int(totals["total"] / totals["count"]) if totals["count"] else 0,
+            total_items=totals["items"]
+        )
     
-    result = query.first()
+    # 取引件数・売上・明細件数を1回の走査で集計する
+    rows = _cube_rows(db, [], start_date, end_date, store_cd)
+    totals = rows[0] if rows else {"count": 0, "total": 0, "average": 0, "items": 0}
     
-    # 明細数カウント
-    detail_query = db.query(func.count(TransactionDetail.dtl_id))
-    if start_date or end_date or store_cd:
-        detail_query = detail_query.join(Transaction)
+    return SalesStatistics(
+        total_transactions=totals["count"],
+        total_sales=totals["total"],
+        average_sale=totals["average"],
+        total_items=totals["items"]
+    )
+
+
+# 売上キューブで集計に使える次元
+CUBE_DIMENSIONS = ("store_cd", "pos_no", "emp_cd", "day", "hour")
+
+
+@app.get("/api/statistics/cube")
+async def get_sales_cube(
+    by: List[str] = Query([], description=f"集計する次元（複数指定可）: {', '.join(CUBE_DIMENSIONS)}"),
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    売上キューブ
+    指定した次元の組み合わせごとに 取引件数・売上合計・平均・明細件数 を1回の集計で返す
+    """
+    invalid = [dim for dim in by if dim not in CUBE_DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"不正な次元です: {', '.join(invalid)}")
+    by = list(dict.fromkeys(by))
+    
+    return await _cached_statistics(
+        "cube", (tuple(by), start_date, end_date, store_cd), start_date, end_date, store_cd, db,
+        lambda: run_db(db, _sales_cube, by, start_date, end_date, store_cd)
+    )
+
+
+def _sales_cube(
+    db: Session,
+    by: List[str],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    store_cd: Optional[str]
+) -> List[dict]:
+    if ANALYTICS_ENGINE_ENABLED and analytics_snapshot.ready and by:
+        return analytics_snapshot.slice(by, start_date, end_date, store_cd)
+    
+    if rollups.SALES_ROLLUPS_ENABLED and set(by) <= {"store_cd", "day", "hour"}:
+        rollup_range = rollups.rollup_range(start_date, end_date)
+        if rollup_range is not None and rollup_range[0] is not None and rollup_range[1] is not None:
+            return _cube_rows_from_rollups(db, by, *rollup_range, store_cd)
+    
+    return _cube_rows(db, by, start_date, end_date, store_cd)
+
+
+def _cube_rows(
+    db: Session,
+    by: List[str],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    store_cd: Optional[str]
+) -> List[dict]:
+    """
+    取引の1回の走査で次元ごとに集計する
+    売上は取引の合計金額（集計テーブル・分析スナップショットと同じ）、明細件数は取引毎の件数を結合して合計する
+    """
+    dimensions = {
+        "store_cd": Transaction.store_cd,
+        "pos_no": Transaction.pos_no,
+        "emp_cd": Transaction.emp_cd,
+        "day": func.date(Transaction.datetime),
+        "hour": extract('hour', Transaction.datetime),
+    }
+    def in_range(query):
         if start_date:
-            detail_query = detail_query.filter(Transaction.datetime >= start_date)
+            query = query.filter(Transaction.datetime >= start_date)
         if end_date:
-            detail_query = detail_query.filter(Transaction.datetime <= end_date)
+            query = query.filter(Transaction.datetime <= end_date)
         if store_cd:
-            detail_query = detail_query.filter(Transaction.store_cd == store_cd)
+            query = query.filter(Transaction.store_cd == store_cd)
+        return query
     
-    item_count = detail_query.scalar()
+    item_counts = in_range(db.query(
+        TransactionDetail.trd_id,
+        func.count(TransactionDetail.dtl_id).label('item_count')
+    ).join(Transaction)).group_by(TransactionDetail.trd_id).subquery()
+    keys = [dimensions[dim].label(dim) for dim in by]
+    query = in_range(db.query(
+        *keys,
+        func.count(Transaction.trd_id).label('count'),
+        func.coalesce(func.sum(Transaction.total_amt), 0).label('total'),
+        func.coalesce(func.sum(item_counts.c.item_count), 0).label('items')
+    ).select_from(Transaction).outerjoin(
+        item_counts, item_counts.c.trd_id == Transaction.trd_id
+    ))
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
     
-    return SalesStatistics(
-        total_transactions=result.count or 0,
-        total_sales=result.total or 0,
-        average_sale=int(result.average) if result.average else 0,
-        total_items=item_count or 0
+    rows = []
+    for r in query.all():
+        count = int(r.count or 0)
+        if not count:
+            continue
+        row = {dim: getattr(r, dim) for dim in by}
+        if "day" in row:
+            row["day"] = str(row["day"])
+        if "hour" in row:
+            row["hour"] = int(row["hour"])
+        total = int(r.total or 0)
+        row.update(count=count, total=total, average=int(total / count), items=int(r.items or 0))
+        rows.append(row)
+    return rows
+
+
+def _cube_rows_from_rollups(db: Session, by: List[str], lo: datetime, hi: datetime, store_cd: Optional[str]) -> List[dict]:
+    """時間別集計テーブルから 店舗・日・時間 の組み合わせで集計する"""
+    query = db.query(
+        SalesHourly.store_cd,
+        SalesHourly.hour_start,
+        SalesHourly.txn_count,
+        SalesHourly.total_amt,
+        SalesHourly.item_count
+    ).filter(SalesHourly.hour_start >= lo, SalesHourly.hour_start < hi)
+    if store_cd:
+        query = query.filter(SalesHourly.store_cd == store_cd)
+    
+    cells = {}
+    for r in query.all():
+        values = {"store_cd": r.store_cd, "day": r.hour_start.date().isoformat(), "hour": r.hour_start.hour}
+        key = tuple(values[dim] for dim in by)
+        cell = cells.setdefault(key, [0, 0, 0])
+        cell[0] += r.txn_count
+        cell[1] += r.total_amt
+        cell[2] += r.item_count
+    
+    return [
+        {**dict(zip(by, key)), "count": count, "total": total, "average": int(total / count), "items": items}
+        for key, (count, total, items) in sorted(cells.items())
+        if count
+    ]
+
+
+# 重複なし件数の集計単位
+DISTINCT_DIMENSIONS = ("store_cd", "day")
+
+
+@app.get("/api/statistics/distinct")
+async def get_distinct_counts(
+    by: List[str] = Query([], description=f"集計する単位（複数指定可）: {', '.join(DISTINCT_DIMENSIONS)}"),
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    重複なし件数（販売商品数・稼働担当者数・稼働POS機数）
+    スケッチが有効で期間が時間単位に揃っている場合は HyperLogLog の推定値（相対誤差 error_rate）、
+    それ以外は COUNT(DISTINCT) による厳密な値を返す
+    """
+    invalid = [dim for dim in by if dim not in DISTINCT_DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"不正な集計単位です: {', '.join(invalid)}")
+    by = [dim for dim in DISTINCT_DIMENSIONS if dim in by]
+    
+    return await _cached_statistics(
+        "distinct", (tuple(by), start_date, end_date, store_cd), start_date, end_date, store_cd, db,
+        lambda: run_db(db, _distinct_counts, by, start_date, end_date, store_cd)
     )
 
 
-@app.get("/api/statistics/top-products")
+def _distinct_counts(
+    db: Session,
+    by: List[str],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    store_cd: Optional[str]
+) -> dict:
+    if distinct.DISTINCT_SKETCHES_ENABLED:
+        rollup_range = rollups.rollup_range(start_date, end_date)
+        if rollup_range is not None:
+            return {
+                "exact": False,
+                "error_rate": round(distinct.HyperLogLog().error_rate, 4),
+                "rows": distinct.distinct_counts(db, *rollup_range, by=by, store_cd=store_cd)
+            }
+    
+    return {
+        "exact": True,
+        "error_rate": 0.0,
+        "rows": distinct.exact_distinct_counts(db, start_date, end_date, by=by, store_cd=store_cd)
+    }
+
+
+@app.get("/api/statistics/top-products", response_model=List[TopProduct])
 async def get_top_products(
+    response: Response,
     limit: int = Query(10, ge=1, le=100),
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db)
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
-    """売れ筋商品ランキング"""
+    """
+    売れ筋商品ランキング
+    X-Result-Exact: 結果が厳密か（false は近似）
+    X-Result-Error-Bound: 販売数の最大誤差（過大評価のみ）
+    """
+    tracked = _top_products_from_tracker(limit, start_date, end_date, store_cd)
+    if tracked is not None:
+        results, exact = tracked
+        response.headers["X-Result-Exact"] = "true" if exact else "false"
+        response.headers["X-Result-Error-Bound"] = str(max((r[2] for r in results), default=0))
+        return [
+            {
+                "prd_id": prd_id,
+                "prd_name": prd_name,
+                "sales_count": count,
+                "total_sales": amount,
+                "max_error": error
+            }
+            for (prd_id, prd_name), count, error, amount in results
+        ]
+    
+    response.headers["X-Result-Exact"] = "true"
+    response.headers["X-Result-Error-Bound"] = "0"
+    return await _cached_statistics(
+        "top_products", (limit, start_date, end_date, store_cd), start_date, end_date, store_cd, db,
+        lambda: run_db(db, _top_products, limit, start_date, end_date, store_cd)
+    )
+
+
+def _top_products_from_tracker(limit, start_date, end_date, store_cd):
+    """売れ筋サマリーから応答できる期間（日単位）ならサマリーで応答する"""
+    if not TOPK_TRACKER_ENABLED:
+        return None
+    day_range = rollups.rollup_range(start_date, end_date)
+    if day_range is None:
+        return None
+    lo, hi = day_range
+    if (lo is not None and lo != rollups.floor_day(lo)) or (hi is not None and hi != rollups.floor_day(hi)):
+        return None
+    return top_products_tracker.top(
+        limit,
+        first_day=lo.date() if lo is not None else None,
+        last_day=(hi - timedelta(days=1)).date() if hi is not None else None,
+        store_cd=store_cd
+    )
+
+
+def _top_products(
+    db: Session,
+    limit: int,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    store_cd: Optional[str] = None
+) -> List[dict]:
+    if ANALYTICS_ENGINE_ENABLED and analytics_snapshot.ready:
+        return analytics_snapshot.top_products(limit, start_date, end_date, store_cd)
+    
+    results = None
+    rollup_range = rollups.rollup_range(start_date, end_date) if rollups.SALES_ROLLUPS_ENABLED else None
+    if rollup_range is not None:
+        results = rollups.top_products(db, *rollup_range, limit, store_cd=store_cd)
+    if results is not None:
+        return [
+            {
+                "prd_id": r.prd_id,
+                "prd_name": r.prd_name,
+                "sales_count": int(r.sales_count),
+                "total_sales": int(r.total_sales)
+            }
+            for r in results
+        ]
+    
     query = db.query(
         TransactionDetail.prd_id,
         TransactionDetail.prd_name,
@@ -561,12 +1357,14 @@ async def get_top_products(
         func.sum(TransactionDetail.prd_price).label('total_sales')
     )
     
-    if start_date or end_date:
+    if start_date or end_date or store_cd:
         query = query.join(Transaction)
         if start_date:
             query = query.filter(Transaction.datetime >= start_date)
         if end_date:
             query = query.filter(Transaction.datetime <= end_date)
+        if store_cd:
+            query = query.filter(Transaction.store_cd == store_cd)
     
     results = query.group_by(
         TransactionDetail.prd_id,
@@ -588,8 +1386,8 @@ async def get_top_products(
 
 @app.get("/api/statistics/hourly-sales")
 async def get_hourly_sales(
-    date: Optional[datetime] = None,
-    db: Session = Depends(get_db)
+    date: Optional[LocalDateTime] = None,
+    db: Session = Depends(get_read_db)
 ):
     """時間帯別売上"""
     if date is None:
@@ -597,9 +1395,37 @@ async def get_hourly_sales(
     
     start = datetime.combine(date, datetime.min.time())
     end = datetime.combine(date, datetime.max.time())
+    return await _cached_statistics(
+        "hourly_sales", (start,), start, end, None, db,
+        lambda: run_db(db, _hourly_sales, date)
+    )
+
+
+def _hourly_sales(db: Session, date) -> List[dict]:
+    start = datetime.combine(date, datetime.min.time())
+    end = datetime.combine(date, datetime.max.time())
+    
+    if ANALYTICS_ENGINE_ENABLED and analytics_snapshot.ready:
+        return [
+            {"hour": r["hour"], "count": r["count"], "total": r["total"]}
+            for r in analytics_snapshot.slice(["hour"], start, end)
+        ]
     
+    if rollups.SALES_ROLLUPS_ENABLED:
+        # 集計テーブルから応答（最大24行）
+        return [
+            {
+                "hour": r.hour_start.hour,
+                "count": int(r.count),
+                "total": int(r.total or 0)
+            }
+            for r in rollups.hourly_sales(db, start, start + timedelta(days=1))
+        ]
+    
+    # extract は MySQL では HOUR()、SQLite では strftime('%H') にコンパイルされる
+    hour = extract('hour', Transaction.datetime)
     results = db.query(
-        func.hour(Transaction.datetime).label('hour'),
+        hour.label('hour'),
         func.count(Transaction.trd_id).label('count'),
         func.sum(Transaction.total_amt).label('total')
     ).filter(
@@ -607,13 +1433,11 @@ async def get_hourly_sales(
             Transaction.datetime >= start,
             Transaction.datetime <= end
         )
-    ).group_by(
-        func.hour(Transaction.datetime)
-    ).order_by('hour').all()
+    ).group_by(hour).order_by('hour').all()
     
     return [
         {
-            "hour": r.hour,
+            "hour": int(r.hour),
             "count": r.count,
             "total": r.total or 0
         }
@@ -621,14 +1445,153 @@ async def get_hourly_sales(
     ]
 
 
+# ヒートマップで指定できる最大日数
+HEATMAP_MAX_DAYS = 366
+WEEKDAY_LABELS = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+@app.get("/api/statistics/heatmap")
+async def get_sales_heatmap(
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None,
+    mode: str = Query("day", pattern="^(day|weekday)$", description="行の単位（day: 日付×時間 / weekday: 曜日×時間）"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    時間帯別売上ヒートマップ（複数日）
+    期間省略時は直近7日間。行（日付または曜日）× 24時間の密な行列を返す。
+    """
+    if end_date is None:
+        end_date = datetime.combine(datetime.now().date(), datetime.max.time())
+    if start_date is None:
+        start_date = datetime.combine(end_date.date() - timedelta(days=6), datetime.min.time())
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date は end_date 以前を指定してください")
+    if (end_date.date() - start_date.date()).days >= HEATMAP_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"期間は{HEATMAP_MAX_DAYS}日以内で指定してください")
+    
+    cells = await _cached_statistics(
+        "heatmap", (start_date, end_date, store_cd), start_date, end_date, store_cd, db,
+        lambda: run_db(db, _heatmap_cells, start_date, end_date, store_cd)
+    )
+    
+    if mode == "weekday":
+        labels = WEEKDAY_LABELS
+        row_of = lambda day: day.weekday()
+    else:
+        days = (end_date.date() - start_date.date()).days + 1
+        labels = [(start_date.date() + timedelta(days=i)).isoformat() for i in range(days)]
+        row_of = lambda day: (day - start_date.date()).days
+    
+    counts = [[0] * 24 for _ in labels]
+    totals = [[0] * 24 for _ in labels]
+    for (day, hour), (count, total) in cells.items():
+        row = row_of(day)
+        counts[row][hour] += count
+        totals[row][hour] += total
+    
+    return {
+        "mode": mode,
+        "start_date": start_date,
+        "end_date": end_date,
+        "store_cd": store_cd,
+        "rows": labels,
+        "hours": list(range(24)),
+        "count": counts,
+        "total": totals
+    }
+
+
+def _heatmap_cells(
+    db: Session,
+    start_date: datetime,
+    end_date: datetime,
+    store_cd: Optional[str]
+) -> dict:
+    """(日付, 時) ごとの取引件数・売上合計を1回のGROUP BYで取得する"""
+    rollup_range = rollups.rollup_range(start_date, end_date) if rollups.SALES_ROLLUPS_ENABLED else None
+    if rollup_range is not None:
+        # 時間別集計テーブルから取得
+        query = db.query(
+            SalesHourly.hour_start,
+            func.sum(SalesHourly.txn_count),
+            func.sum(SalesHourly.total_amt)
+        ).filter(
+            SalesHourly.hour_start >= rollup_range[0],
+            SalesHourly.hour_start < rollup_range[1]
+        )
+        if store_cd:
+            query = query.filter(SalesHourly.store_cd == store_cd)
+        return {
+            (hour_start.date(), hour_start.hour): (int(count or 0), int(total or 0))
+            for hour_start, count, total in query.group_by(SalesHourly.hour_start).all()
+        }
+    
+    # date() と EXTRACT(hour) は MySQL / SQLite の両方で使える
+    sales_day = func.date(Transaction.datetime)
+    sales_hour = extract('hour', Transaction.datetime)
+    query = db.query(
+        sales_day,
+        sales_hour,
+        func.count(Transaction.trd_id),
+        func.sum(Transaction.total_amt)
+    ).filter(
+        Transaction.datetime >= start_date,
+        Transaction.datetime <= end_date
+    )
+    if store_cd:
+        query = query.filter(Transaction.store_cd == store_cd)
+    
+    cells = {}
+    for day, hour, count, total in query.group_by(sales_day, sales_hour).all():
+        if isinstance(day, str):
+            day = date_type.fromisoformat(day)
+        cells[(day, int(hour))] = (int(count), int(total or 0))
+    return cells
+
+
+# ===== 分析 API（列指向スナップショット） =====
+
+@app.get("/api/analytics/slice")
+async def get_analytics_slice(
+    by: List[str] = Query(..., description=f"集計する次元（複数指定可）: {', '.join(DIMENSIONS)}"),
+    start_date: Optional[LocalDateTime] = None,
+    end_date: Optional[LocalDateTime] = None,
+    store_cd: Optional[str] = None,
+):
+    """任意の次元（店舗・担当者・POS機・日・時間・曜日・曜日×時間）での売上集計"""
+    if not ANALYTICS_ENGINE_ENABLED:
+        raise HTTPException(status_code=404, detail="分析エンジンが無効です（ANALYTICS_ENGINE=1 で有効化）")
+    invalid = [dim for dim in by if dim not in DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"不正な次元です: {', '.join(invalid)}")
+    if not analytics_snapshot.ready:
+        raise HTTPException(status_code=503, detail="分析スナップショットを読み込み中です")
+    
+    return analytics_snapshot.slice(by, start_date, end_date, store_cd)
+
+
+@app.get("/api/analytics/status")
+async def get_analytics_status():
+    """スナップショットのメモリ使用量と更新遅延"""
+    return {"enabled": ANALYTICS_ENGINE_ENABLED, **analytics_snapshot.status()}
+
+
 # ===== エラーハンドリング =====
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    return {
-        "error": exc.detail,
-        "status_code": exc.status_code
-    }
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "error": exc.detail,
+            "status_code": exc.status_code
+        }
+    )
+
+
+startup_timer.mark("import", time.perf_counter() - _import_started)
 
 
 if __name__ == "__main__":
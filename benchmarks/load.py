@@ -0,0 +1,482 @@
+# benchmarks/load.py
+"""
+商品検索・購入 API の負荷ベンチマーク
+
+ローカルの DB（既定は SQLite ファイル）に商品マスタを投入してアプリを起動し、
+複数のレジを模した並列クライアントから「バーコードスキャン（/api/product-search）を
+かご点数分 → 購入（/api/purchase）」の流れを一定時間繰り返す。
+エンドポイント毎のスループットと p50/p95/p99 レイテンシを表示し、JSON に保存する。
+ベースラインの JSON を指定すると比較し、閾値を超えて悪化した項目があれば終了コード 1 を返す。
+
+使い方:
+    python -m benchmarks.load
+    python -m benchmarks.load --clients 16 --duration 60 --output results.json
+    python -m benchmarks.load --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --baseline benchmarks/baseline.json
+    python -m benchmarks.load --server-env PRODUCT_CACHE_TTL=0 --server-env DB_POOL_SIZE=20
+    python -m benchmarks.load --base-url http://localhost:8000   # 起動済みのサーバーを計測（投入なし）
+    python -m benchmarks.load --database-url mysql+pymysql://.../bench --reset   # 一時ディレクトリ外のDBを使う場合
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.engine import make_url
+
+from db_control.models import (
+    Base, ProductMaster, Transaction, TransactionDetail,
+    SalesHourly, SalesDaily, ProductSalesDaily, DistinctSketchHourly,
+)
+
+# 投入時に空にするテーブル（取引から作られる集計テーブルを先に消す）
+RESET_MODELS = (
+    SalesHourly, SalesDaily, ProductSalesDaily, DistinctSketchHourly,
+    TransactionDetail, Transaction, ProductMaster,
+)
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SEARCH = "GET /api/product-search"
+PURCHASE = "POST /api/purchase"
+ENDPOINTS = (SEARCH, PURCHASE)
+
+# かご点数の分布（点数: 重み）。小型店舗のPOSを想定し、1〜3点が大半で稀に大量購入がある
+BASKET_SIZE_WEIGHTS = {
+    1: 30, 2: 22, 3: 15, 4: 10, 5: 7, 6: 5, 7: 3, 8: 2.5, 10: 2, 12: 1.5, 15: 1, 20: 1,
+}
+
+# 比較対象の指標（キー, 大きいほど良いか）
+COMPARED_METRICS = (
+    ("throughput_rps", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+)
+
+
+# ===== 商品マスタの投入 =====
+
+def jan_code(n):
+    """連番からチェックディジット付きの JAN（13桁）を作る"""
+    body = f"49{n:010d}"
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def is_scratch_url(url):
+    """削除してよいベンチマーク用のDBか（インメモリ SQLite、または一時ディレクトリ内の SQLite ファイル）"""
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if url.database in (None, "", ":memory:"):
+        return True
+    return Path(url.database).resolve().is_relative_to(Path(tempfile.gettempdir()).resolve())
+
+
+def seed_catalog(url, products, seed, reset=False):
+    """
+    取引・集計テーブル・商品マスタを空にして商品を投入する（価格は 80〜3000 円の対数正規分布）
+    一時DB（is_scratch_url）以外は reset=True のときのみ削除する
+    """
+    if not reset and not is_scratch_url(url):
+        raise ValueError(
+            f"{make_url(url).render_as_string(hide_password=True)} は一時DBではないため投入しません"
+            "（既存の取引・商品マスタを削除してよい場合は --reset を指定してください）"
+        )
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    try:
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            for model in RESET_MODELS:
+                conn.execute(delete(model))
+            conn.execute(insert(ProductMaster), [
+                {
+                    "code": jan_code(i),
+                    "name": f"ベンチ商品{i}",
+                    "price": int(min(3000, max(80, rng.lognormvariate(5.3, 0.6)))) // 10 * 10,
+                }
+                for i in range(1, products + 1)
+            ])
+            return [row.code for row in conn.execute(select(ProductMaster.code).order_by(ProductMaster.prd_id))]
+    finally:
+        engine.dispose()
+
+
+def fetch_catalog(base_url):
+    """起動済みサーバーから商品コードの一覧を取得する（カーソルでページング）"""
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    codes, cursor = [], None
+    try:
+        while True:
+            params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+            conn.request("GET", f"/api/products?{urlencode(params)}")
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError(f"商品一覧の取得に失敗しました: HTTP {response.status}")
+            codes.extend(p["code"] for p in json.loads(body))
+            cursor = response.getheader("X-Next-Cursor")
+            if not cursor:
+                return codes
+    finally:
+        conn.close()
+
+
+# ===== アプリの起動 =====
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(host, port, timeout):
+    """/health/ready が 200 を返すまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+            conn.close()
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"アプリが {timeout} 秒以内に起動しませんでした")
+
+
+def start_server(database_url, port, workers, server_env, timeout):
+    """uvicorn でアプリを別プロセスとして起動する"""
+    env = {**os.environ, "DATABASE_URL": database_url, **server_env}
+    command = [
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_ready("127.0.0.1", port, timeout)
+    except Exception:
+        process.terminate()
+        process.wait()
+        raise
+    return process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# ===== 負荷生成 =====
+
+class Register(threading.Thread):
+    """
+    1台のレジ（クライアント）。Keep-Alive の接続を1本持ち、
+    かご点数分の商品検索 → 購入 を終了時刻まで繰り返す
+    """
+
+    def __init__(self, index, host, port, codes, cum_weights, args, measure_from, stop_at):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.codes = codes
+        self.cum_weights = cum_weights
+        self.args = args
+        self.measure_from = measure_from
+        self.stop_at = stop_at
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.pos_no = f"{index % 1000:03d}"
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.conn = None
+
+    def _request(self, name, method, path, body=None):
+        """1リクエストを送り、(ステータス, JSON) を返す。計測期間内ならレイテンシを記録する"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.args.timeout)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            status, payload = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            status, payload = None, b""
+        finished = time.perf_counter()
+
+        data = json.loads(payload) if status == 200 else None
+        ok = status == 200 and (name != PURCHASE or bool(data and data.get("success")))
+        if started >= self.measure_from:
+            self.samples[name].append(finished - started)
+            if not ok:
+                self.errors[name] += 1
+        return data
+
+    def run(self):
+        sizes, size_weights = zip(*BASKET_SIZE_WEIGHTS.items())
+        while time.perf_counter() < self.stop_at:
+            basket = []
+            for _ in range(self.rng.choices(sizes, size_weights)[0]):
+                if self.rng.random() < self.args.miss_rate:
+                    code = f"{self.rng.randrange(10 ** 12):013d}"  # 未登録のコード（読み取りミスなど）
+                else:
+                    code = self.rng.choices(self.codes, cum_weights=self.cum_weights)[0]
+                product = self._request(SEARCH, "GET", f"/api/product-search?{urlencode({'code': code})}")
+                if product:
+                    basket.append({
+                        "prd_id": product["prd_id"], "prd_code": product["code"],
+                        "prd_name": product["name"], "prd_price": product["price"],
+                    })
+            if basket:
+                body = json.dumps({"emp_cd": "9999999999", "store_cd": "30", "pos_no": self.pos_no, "products": basket})
+                self._request(PURCHASE, "POST", "/api/purchase", body)
+            if self.args.think_ms:
+                time.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+        if self.conn is not None:
+            self.conn.close()
+
+
+def zipf_cum_weights(n, exponent):
+    """人気順の累積重み（売れ筋に検索が集中する分布）"""
+    total, weights = 0.0, []
+    for rank in range(1, n + 1):
+        total += 1 / rank ** exponent
+        weights.append(total)
+    return weights
+
+
+def run_load(host, port, codes, args):
+    """全レジを起動し、ウォームアップ後の計測期間のサンプルを集計する"""
+    cum_weights = zipf_cum_weights(len(codes), args.zipf)
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    registers = [
+        Register(i, host, port, codes, cum_weights, args, measure_from, stop_at)
+        for i in range(args.clients)
+    ]
+    for register in registers:
+        register.start()
+    for register in registers:
+        register.join()
+    elapsed = time.perf_counter() - measure_from
+
+    return {
+        name: summarize(
+            [s for r in registers for s in r.samples[name]],
+            sum(r.errors[name] for r in registers),
+            elapsed,
+        )
+        for name in ENDPOINTS
+    }
+
+
+def summarize(samples, errors, elapsed):
+    """件数・スループット・レイテンシ分位点（ミリ秒）"""
+    if not samples:
+        return {"requests": 0, "errors": errors, "throughput_rps": 0.0}
+    ms = sorted(s * 1000 for s in samples)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else [ms[0]] * 99
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "error_rate": round(errors / len(ms), 4),
+        "throughput_rps": round(len(ms) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(ms), 2),
+        "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2),
+        "p99_ms": round(cuts[98], 2),
+        "max_ms": round(ms[-1], 2),
+    }
+
+
+# ===== ベースライン比較 =====
+
+def compare(results, baseline, tolerance):
+    """
+    ベースラインとの差分を返す（悪化率が tolerance を超えた項目は regression=True）
+    スループットは低下、レイテンシは増加を悪化とみなす
+    """
+    rows = []
+    for name in ENDPOINTS:
+        current, base = results["endpoints"].get(name), baseline["endpoints"].get(name)
+        if not current or not base:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            rows.append({
+                "endpoint": name, "metric": metric, "baseline": old, "current": new,
+                "change": round(change, 4), "regression": worse > tolerance,
+            })
+    return rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'エンドポイント':<26}{'件数':>8}{'エラー':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in results["endpoints"].items():
+        if not r["requests"]:
+            print(f"{name:<26}{0:>8}{r['errors']:>8}")
+            continue
+        print(
+            f"{name:<26}{r['requests']:>8}{r['errors']:>8}{r['throughput_rps']:>10.1f}"
+            f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}"
+        )
+
+
+def print_comparison(rows, baseline):
+    meta = baseline.get("meta", {})
+    print(f"\nベースライン比較（{meta.get('timestamp', '?')}, rev {meta.get('git_revision') or '?'}）")
+    for row in rows:
+        flag = "  ⚠️ 悪化" if row["regression"] else ""
+        print(
+            f"  {row['endpoint']:<26}{row['metric']:<16}{row['baseline']:>10}"
+            f" → {row['current']:>10}  ({row['change']:+.1%}){flag}"
+        )
+
+
+def parse_env(items):
+    env = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--server-env は KEY=VALUE 形式で指定してください: {item}")
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="商品検索・購入 API の負荷ベンチマーク")
+    parser.add_argument("--database-url", default="sqlite:////tmp/pos_load_bench.db",
+                        help="アプリに渡す DATABASE_URL（既定: 一時ディレクトリの SQLite ファイル。投入時に既存データを削除する）")
+    parser.add_argument("--reset", action="store_true",
+                        help="一時DB（インメモリ・一時ディレクトリの SQLite）以外でも既存データを削除して投入する")
+    parser.add_argument("--base-url", help="起動済みサーバーの URL（指定時は投入・起動をしない）")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn のワーカー数")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="アプリに渡す環境変数（機能フラグの比較用、複数指定可）")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--products", type=int, default=5000, help="投入する商品数")
+    parser.add_argument("--clients", type=int, default=8, help="並列レジ数")
+    parser.add_argument("--duration", type=float, default=30, help="計測時間（秒）")
+    parser.add_argument("--warmup", type=float, default=5, help="計測前のウォームアップ（秒）")
+    parser.add_argument("--think-ms", type=float, default=0, help="取引間の平均待ち時間（ミリ秒、0 で連続）")
+    parser.add_argument("--miss-rate", type=float, default=0.02, help="未登録コードをスキャンする割合")
+    parser.add_argument("--zipf", type=float, default=1.1, help="商品人気の偏り（Zipf 指数）")
+    parser.add_argument("--timeout", type=float, default=30, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON ファイル")
+    parser.add_argument("--save-baseline", help="結果をベースラインとして保存する JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="悪化とみなす変化率（既定 0.10 = 10%%）")
+    args = parser.parse_args()
+    server_env = parse_env(args.server_env)
+
+    process = None
+    if args.base_url:
+        parts = urlsplit(args.base_url)
+        host, port = parts.hostname, parts.port or 80
+        codes = fetch_catalog(args.base_url)
+        target = args.base_url
+    else:
+        try:
+            codes = seed_catalog(args.database_url, args.products, args.seed, reset=args.reset)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        host, port = "127.0.0.1", free_port()
+        process = start_server(args.database_url, port, args.workers, server_env, args.startup_timeout)
+        target = args.database_url
+    if not codes:
+        raise SystemExit("商品マスタが空です")
+
+    # 人気順はシードで固定（実行毎に同じ商品が売れ筋になる）
+    random.Random(args.seed).shuffle(codes)
+
+    print(f"対象: {target}  商品数: {len(codes)}  並列数: {args.clients}  計測: {args.duration}秒（ウォームアップ {args.warmup}秒）")
+    try:
+        endpoints = run_load(host, port, codes, args)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "target": target,
+            "workers": None if args.base_url else args.workers,
+            "server_env": server_env,
+            "products": len(codes),
+            "clients": args.clients,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "think_ms": args.think_ms,
+            "miss_rate": args.miss_rate,
+            "zipf": args.zipf,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "endpoints": endpoints,
+    }
+    print_results(results)
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        rows = compare(results, baseline, args.tolerance)
+        results["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "rows": rows}
+        print_comparison(rows, baseline)
+        regressions = [row for row in rows if row["regression"]]
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).write_text(json.dumps(results, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"保存しました: {path}")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)}項目がベースラインより {args.tolerance:.0%} 以上悪化しました")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
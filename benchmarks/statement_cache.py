@@ -0,0 +1,122 @@
+# benchmarks/statement_cache.py
+"""
+高頻度SQL（商品検索・購入登録）のマイクロベンチマーク
+
+ORM クエリをリクエスト毎に組み立てる従来の書き方と、db_control/statements.py の
+作成済みの文を使う書き方で、1回あたりの CPU 時間を比較する。
+DB の応答時間の影響を除くため、既定ではインメモリの SQLite で計測する。
+
+使い方:
+    python -m benchmarks.statement_cache
+    python -m benchmarks.statement_cache --iterations 20000 --url sqlite:////tmp/bench.db
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db_control.models import Base, ProductMaster, Transaction, TransactionDetail
+from db_control.statements import (
+    fetch_product_by_code, fetch_product_by_id,
+    INSERT_TRANSACTION, INSERT_TRANSACTION_DETAILS,
+)
+
+
+# ===== 従来の書き方 =====
+
+def orm_product_by_code(db, code):
+    return db.query(ProductMaster).filter(ProductMaster.code == code).first()
+
+
+def orm_product_by_id(db, prd_id):
+    return db.query(ProductMaster).filter(ProductMaster.prd_id == prd_id).first()
+
+
+def orm_purchase_insert(db, details):
+    result = db.execute(
+        insert(Transaction).values(
+            datetime=datetime.now(), emp_cd="9999999999", store_cd="30", pos_no="90",
+            total_amt=sum(d["prd_price"] for d in details)
+        )
+    )
+    trd_id = result.inserted_primary_key[0]
+    db.execute(insert(TransactionDetail), [{"trd_id": trd_id, "dtl_id": i, **d} for i, d in enumerate(details, 1)])
+
+
+# ===== 作成済みの文 =====
+
+def cached_purchase_insert(db, details):
+    result = db.execute(INSERT_TRANSACTION, {
+        "datetime": datetime.now(), "emp_cd": "9999999999", "store_cd": "30", "pos_no": "90",
+        "total_amt": sum(d["prd_price"] for d in details),
+    })
+    trd_id = result.inserted_primary_key[0]
+    db.execute(INSERT_TRANSACTION_DETAILS, [{"trd_id": trd_id, "dtl_id": i, **d} for i, d in enumerate(details, 1)])
+
+
+def measure(session_factory, fn, args_for, iterations):
+    """1回あたりの CPU 時間（マイクロ秒）。セッションは計測毎に1つ使い回す"""
+    db = session_factory()
+    try:
+        for i in range(min(iterations, 200)):  # ウォームアップ（コンパイル済みSQLのキャッシュを作る）
+            fn(db, *args_for(i))
+        db.rollback()
+        started = time.process_time()
+        for i in range(iterations):
+            fn(db, *args_for(i))
+        elapsed = time.process_time() - started
+        db.rollback()
+    finally:
+        db.close()
+    return elapsed / iterations * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="高頻度SQLのマイクロベンチマーク")
+    parser.add_argument("--url", default="sqlite://", help="接続先（既定: インメモリ SQLite）")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+
+    with session_factory() as db:
+        if not db.query(ProductMaster).count():
+            db.execute(insert(ProductMaster), [
+                {"code": f"{i:013d}", "name": f"商品{i}", "price": 100 + i} for i in range(1, args.products + 1)
+            ])
+            db.commit()
+
+    def by_code(i):
+        return (f"{i % args.products + 1:013d}",)
+
+    def by_id(i):
+        return (i % args.products + 1,)
+
+    details = [
+        {"prd_id": 1, "prd_code": "0000000000001", "prd_name": "商品1", "prd_price": 101},
+        {"prd_id": 2, "prd_code": "0000000000002", "prd_name": "商品2", "prd_price": 102},
+        {"prd_id": 3, "prd_code": "0000000000003", "prd_name": "商品3", "prd_price": 103},
+    ]
+
+    cases = [
+        ("商品検索（コード）", orm_product_by_code, fetch_product_by_code, by_code),
+        ("商品検索（ID）", orm_product_by_id, fetch_product_by_id, by_id),
+        ("購入登録（明細3件）", orm_purchase_insert, cached_purchase_insert, lambda i: (details,)),
+    ]
+
+    print(f"接続先: {engine.url.render_as_string(hide_password=True)}  反復回数: {args.iterations}")
+    print(f"{'処理':<20}{'従来 (µs)':>12}{'作成済み (µs)':>16}{'削減 (µs)':>12}{'削減率':>8}")
+    for label, before, after, args_for in cases:
+        old = measure(session_factory, before, args_for, args.iterations)
+        new = measure(session_factory, after, args_for, args.iterations)
+        print(f"{label:<20}{old:>12.1f}{new:>16.1f}{old - new:>12.1f}{(old - new) / old:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ POSシステム用サンプルデータ作成スクリプト
 仕様書に準拠したテストデータを生成します
 """
 
+from sqlalchemy import func
 from db_control.connection import SessionLocal, test_connection
 from db_control.models import ProductMaster, Transaction, TransactionDetail
 from datetime import datetime, timedelta
@@ -102,9 +103,7 @@ def create_sample_data():
         product_count = session.query(ProductMaster).count()
         transaction_count = session.query(Transaction).count()
         detail_count = session.query(TransactionDetail).count()
-        total_sales = session.query(Transaction).with_entities(
-            session.query(Transaction).with_entities(Transaction.total_amt).label('total')
-        ).scalar() or 0
+        total_sales = session.query(func.sum(Transaction.total_amt)).scalar() or 0
         
         print(f"   - 商品数: {product_count}件")
         print(f"   - 取引数: {transaction_count}件")
@@ -1,9 +1,11 @@
 ﻿import os
 import sys
 from pathlib import Path
-from sqlalchemy import text
-from .connection import engine, Base, SessionLocal, test_connection
+from sqlalchemy import text, inspect
+from .connection import get_engine, Base, SessionLocal, test_connection
 from .models import ProductMaster, Transaction, TransactionDetail
+from .rollups import main as rebuild_sales_rollups
+from .distinct import main as rebuild_distinct_sketches
 
 def create_all_tables():
     """全テーブルを作成"""
@@ -13,23 +15,16 @@ def create_all_tables():
     
     try:
         # テーブル作成
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
         print("✅ 全テーブルの作成に成功しました")
         
         # 作成されたテーブルの確認
-        with engine.connect() as connection:
-            result = connection.execute(text("""
-                SELECT TABLE_NAME 
-                FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_TYPE = 'BASE TABLE'
-                ORDER BY TABLE_NAME
-            """))
-            tables = result.fetchall()
+        with get_engine().connect() as connection:
+            tables = sorted(inspect(connection).get_table_names())
             
             print("\n📋 作成されたテーブル:")
             for table in tables:
-                print(f"   - {table[0]}")
+                print(f"   - {table}")
         
         return True
         
@@ -52,7 +47,7 @@ def drop_all_tables():
         return False
     
     try:
-        Base.metadata.drop_all(bind=engine)
+        Base.metadata.drop_all(bind=get_engine())
         print("✅ 全テーブルの削除に成功しました")
         return True
         
@@ -113,6 +108,27 @@ def add_sample_data():
         session.close()
 
 
+def _print_schema(connection):
+    """inspector によるテーブル・カラム・インデックス・外部キーの一覧（MySQL 以外）"""
+    inspector = inspect(connection)
+    tables = sorted(inspector.get_table_names())
+    
+    print(f"\n📋 テーブル情報 ({connection.dialect.name}):")
+    for table in tables:
+        print(f"   - {table}: {len(inspector.get_columns(table))}カラム")
+    
+    print("\n📇 インデックス情報:")
+    for table in tables:
+        for index in inspector.get_indexes(table):
+            unique_str = "UNIQUE" if index.get("unique") else "NON-UNIQUE"
+            print(f"   - {table}.{index['name']} ({unique_str})")
+    
+    print("\n🔗 外部キー制約:")
+    for table in tables:
+        for fk in inspector.get_foreign_keys(table):
+            print(f"   - {fk.get('name') or '(unnamed)'}: {table} -> {fk['referred_table']}")
+
+
 def verify_database():
     """データベース構造の検証"""
     print("=" * 60)
@@ -123,71 +139,75 @@ def verify_database():
     
     try:
         # テーブル確認
-        with engine.connect() as connection:
-            # テーブル一覧
-            result = connection.execute(text("""
-                SELECT 
-                    TABLE_NAME,
-                    TABLE_ROWS,
-                    ENGINE,
-                    TABLE_COLLATION
-                FROM INFORMATION_SCHEMA.TABLES
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_TYPE = 'BASE TABLE'
-                ORDER BY TABLE_NAME
-            """))
+        with get_engine().connect() as connection:
+            if connection.dialect.name != "mysql":
+                # MySQL 以外（ローカル検証用の SQLite など）は INFORMATION_SCHEMA が無いため inspector で確認する
+                _print_schema(connection)
+            else:
+                # テーブル一覧
+                result = connection.execute(text("""
+                    SELECT 
+                        TABLE_NAME,
+                        TABLE_ROWS,
+                        ENGINE,
+                        TABLE_COLLATION
+                    FROM INFORMATION_SCHEMA.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE()
+                      AND TABLE_TYPE = 'BASE TABLE'
+                    ORDER BY TABLE_NAME
+                """))
             
-            print("\n📋 テーブル情報:")
-            for row in result:
-                print(f"   - {row[0]}: {row[1]}行, Engine={row[2]}, Collation={row[3]}")
+                print("\n📋 テーブル情報:")
+                for row in result:
+                    print(f"   - {row[0]}: {row[1]}行, Engine={row[2]}, Collation={row[3]}")
             
-            # カラム情報
-            result = connection.execute(text("""
-                SELECT 
-                    TABLE_NAME,
-                    COUNT(*) as ColumnCount
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE()
-                GROUP BY TABLE_NAME
-                ORDER BY TABLE_NAME
-            """))
+                # カラム情報
+                result = connection.execute(text("""
+                    SELECT 
+                        TABLE_NAME,
+                        COUNT(*) as ColumnCount
+                    FROM INFORMATION_SCHEMA.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    GROUP BY TABLE_NAME
+                    ORDER BY TABLE_NAME
+                """))
             
-            print("\n📝 カラム数:")
-            for row in result:
-                print(f"   - {row[0]}: {row[1]}カラム")
+                print("\n📝 カラム数:")
+                for row in result:
+                    print(f"   - {row[0]}: {row[1]}カラム")
             
-            # インデックス確認
-            result = connection.execute(text("""
-                SELECT 
-                    TABLE_NAME,
-                    INDEX_NAME,
-                    NON_UNIQUE,
-                    INDEX_TYPE
-                FROM INFORMATION_SCHEMA.STATISTICS
-                WHERE TABLE_SCHEMA = DATABASE()
-                ORDER BY TABLE_NAME, INDEX_NAME
-            """))
+                # インデックス確認
+                result = connection.execute(text("""
+                    SELECT 
+                        TABLE_NAME,
+                        INDEX_NAME,
+                        NON_UNIQUE,
+                        INDEX_TYPE
+                    FROM INFORMATION_SCHEMA.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    ORDER BY TABLE_NAME, INDEX_NAME
+                """))
             
-            print("\n📇 インデックス情報:")
-            for row in result:
-                unique_str = "UNIQUE" if row[2] == 0 else "NON-UNIQUE"
-                print(f"   - {row[0]}.{row[1]} ({unique_str}, {row[3]})")
+                print("\n📇 インデックス情報:")
+                for row in result:
+                    unique_str = "UNIQUE" if row[2] == 0 else "NON-UNIQUE"
+                    print(f"   - {row[0]}.{row[1]} ({unique_str}, {row[3]})")
             
-            # 外部キー制約確認
-            result = connection.execute(text("""
-                SELECT 
-                    CONSTRAINT_NAME,
-                    TABLE_NAME,
-                    REFERENCED_TABLE_NAME
-                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND REFERENCED_TABLE_NAME IS NOT NULL
-                ORDER BY TABLE_NAME
-            """))
+                # 外部キー制約確認
+                result = connection.execute(text("""
+                    SELECT 
+                        CONSTRAINT_NAME,
+                        TABLE_NAME,
+                        REFERENCED_TABLE_NAME
+                    FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+                    WHERE TABLE_SCHEMA = DATABASE()
+                      AND REFERENCED_TABLE_NAME IS NOT NULL
+                    ORDER BY TABLE_NAME
+                """))
             
-            print("\n🔗 外部キー制約:")
-            for row in result:
-                print(f"   - {row[0]}: {row[1]} -> {row[2]}")
+                print("\n🔗 外部キー制約:")
+                for row in result:
+                    print(f"   - {row[0]}: {row[1]} -> {row[2]}")
         
         # レコード数確認
         product_count = session.query(ProductMaster).count()
@@ -230,10 +250,12 @@ def main():
     print("2. サンプルデータ追加")
     print("3. データベース検証")
     print("4. 全実行（テーブル作成 → サンプルデータ追加 → 検証）")
+    print("5. 売上集計テーブル再構築")
+    print("6. 重複なし件数スケッチ再構築")
     print("9. 全テーブル削除（危険）")
     print("0. 終了")
     
-    choice = input("\n選択してください (0-4, 9): ")
+    choice = input("\n選択してください (0-6, 9): ")
     
     if choice == '1':
         create_all_tables()
@@ -245,6 +267,10 @@ def main():
         if create_all_tables():
             add_sample_data()
             verify_database()
+    elif choice == '5':
+        rebuild_sales_rollups()
+    elif choice == '6':
+        rebuild_distinct_sketches()
     elif choice == '9':
         drop_all_tables()
     elif choice == '0':
@@ -0,0 +1,265 @@
+# db_control/analytics.py
+"""
+列指向スナップショットによるプロセス内分析エンジン
+
+取引・取引明細をワーカー内の pandas DataFrame（列指向の NumPy 配列）に保持し、
+統計APIやアドホックな切り口（店舗・担当者・POS機・曜日×時間）の集計を
+MySQL へ問い合わせずにベクトル化した group-by で計算する。
+
+スナップショットは trd_id のウォーターマークで増分更新する。
+コミット順と採番順の逆転で取りこぼさないよう、ウォーターマーク直前の一定件数は
+毎回読み直して置き換える。更新（定期的な全件の読み直しを含む）は lifespan のバックグラウンドタスクが
+ANALYTICS_REFRESH_SECONDS ごとに読み取りレプリカから行い、リクエストは読み込み済みのスナップショットを参照するだけにする。
+"""
+
+import os
+import threading
+import time
+
+from .models import Transaction, TransactionDetail
+
+
+# pandas / NumPy は読み込みに時間がかかるため、スナップショットを初めて使うときに読み込む
+np = None
+pd = None
+
+
+def _load_pandas():
+    global np, pd
+    if pd is None:
+        import numpy
+        import pandas
+        np, pd = numpy, pandas
+
+
+# スライスに使える次元
+DIMENSIONS = ("store_cd", "emp_cd", "pos_no", "day", "hour", "weekday", "hour_of_week")
+
+TRANSACTION_COLUMNS = ["trd_id", "datetime", "emp_cd", "store_cd", "pos_no", "total_amt", "items"]
+DETAIL_COLUMNS = ["trd_id", "datetime", "store_cd", "prd_id", "prd_name", "prd_price"]
+
+
+def _empty(columns):
+    return pd.DataFrame({c: pd.Series(dtype="datetime64[ns]" if c == "datetime" else "object") for c in columns})
+
+
+class AnalyticsSnapshot:
+    """取引・取引明細の列指向スナップショット"""
+
+    def __init__(self, refresh_interval=5.0, full_reload_interval=3600.0, overlap=1000):
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.overlap = overlap
+        self.transactions = None  # 初回の更新・集計時に作成する
+        self.details = None
+        self.watermark = 0
+        self.refreshed_at = None
+        self.reloaded_at = None
+        self.last_refresh_seconds = 0.0
+        self._lock = threading.Lock()          # フレームの差し替え・削除の反映
+        self._refresh_lock = threading.Lock()  # 更新の直列化（DB読み込み中もフレームの参照・削除は止めない）
+        self._forgotten = None                 # 更新中に削除された trd_id（差し替え時に除く）
+
+    @property
+    def ready(self):
+        """初回の読み込みが完了しているか"""
+        return self.refreshed_at is not None
+
+    def _ensure_frames(self):
+        if self.transactions is None:
+            _load_pandas()
+            self.transactions = _empty(TRANSACTION_COLUMNS)
+            self.details = _empty(DETAIL_COLUMNS)
+
+    # ----- 更新 -----
+
+    def refresh(self, db, force=False):
+        """
+        前回の更新から refresh_interval 以上経過していれば増分更新する（ブロッキング、バックグラウンドで呼ぶ）
+        DBの読み込みとフレームの作成はロックの外で行い、完成後に差し替える
+        """
+        with self._refresh_lock:
+            with self._lock:
+                self._ensure_frames()
+                if not force and self.refreshed_at is not None \
+                        and time.monotonic() - self.refreshed_at < self.refresh_interval:
+                    return
+                transactions, details, watermark = self.transactions, self.details, self.watermark
+                self._forgotten = set()
+            started = time.perf_counter()
+            # 他ワーカーでの取引削除を取り込むため、定期的に全件を読み直す
+            full = self.reloaded_at is None or time.monotonic() - self.reloaded_at > self.full_reload_interval
+            low = 0 if full else max(watermark - self.overlap, 0)
+
+            try:
+                headers = db.query(
+                    Transaction.trd_id, Transaction.datetime, Transaction.emp_cd,
+                    Transaction.store_cd, Transaction.pos_no, Transaction.total_amt
+                ).filter(Transaction.trd_id > low).order_by(Transaction.trd_id).all()
+                lines = db.query(
+                    TransactionDetail.trd_id, Transaction.datetime, Transaction.store_cd,
+                    TransactionDetail.prd_id, TransactionDetail.prd_name, TransactionDetail.prd_price
+                ).join(Transaction).filter(TransactionDetail.trd_id > low).order_by(TransactionDetail.trd_id).all()
+
+                new_details = pd.DataFrame(lines, columns=DETAIL_COLUMNS)
+                new_headers = pd.DataFrame(headers, columns=TRANSACTION_COLUMNS[:-1])
+                new_headers["items"] = new_headers["trd_id"].map(
+                    new_details.groupby("trd_id").size()
+                ).fillna(0).astype("int64")
+
+                transactions = self._replace_tail(transactions, new_headers, low)
+                details = self._replace_tail(details, new_details, low)
+            except BaseException:
+                with self._lock:
+                    self._forgotten = None
+                raise
+
+            with self._lock:
+                if self._forgotten:
+                    transactions = transactions[~transactions["trd_id"].isin(self._forgotten)]
+                    details = details[~details["trd_id"].isin(self._forgotten)]
+                self._forgotten = None
+                self.transactions, self.details = transactions, details
+                if len(transactions):
+                    self.watermark = int(transactions["trd_id"].iloc[-1])
+                now = time.monotonic()
+                if full:
+                    self.reloaded_at = now
+                self.refreshed_at = now
+                self.last_refresh_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _replace_tail(frame, fresh, low):
+        """trd_id > low の末尾を読み直した行で置き換える（trd_id 昇順を維持）"""
+        keep = int(np.searchsorted(frame["trd_id"].to_numpy(dtype="int64"), low, side="right"))
+        fresh = fresh.astype({"datetime": "datetime64[ns]"})
+        if keep == 0:
+            combined = fresh.reset_index(drop=True)
+        elif not len(fresh):
+            return frame.iloc[:keep]
+        else:
+            combined = pd.concat([frame.iloc[:keep], fresh], ignore_index=True)
+        # 値の種類が少ないコード列はカテゴリ型にしてメモリを抑える
+        for column in ("emp_cd", "store_cd", "pos_no", "prd_name"):
+            if column in combined:
+                combined[column] = combined[column].astype("category")
+        return combined
+
+    def forget(self, trd_id):
+        """削除された取引をスナップショットから除く"""
+        with self._lock:
+            if self._forgotten is not None:
+                self._forgotten.add(trd_id)
+            if self.transactions is None:
+                return
+            self.transactions = self.transactions[self.transactions["trd_id"] != trd_id]
+            self.details = self.details[self.details["trd_id"] != trd_id]
+
+    # ----- 集計 -----
+
+    @staticmethod
+    def _filter(frame, start_date=None, end_date=None, store_cd=None):
+        mask = np.ones(len(frame), dtype=bool)
+        if start_date is not None:
+            mask &= (frame["datetime"] >= pd.Timestamp(start_date)).to_numpy()
+        if end_date is not None:
+            mask &= (frame["datetime"] <= pd.Timestamp(end_date)).to_numpy()
+        if store_cd:
+            mask &= (frame["store_cd"] == store_cd).to_numpy()
+        return frame[mask]
+
+    def sales(self, start_date=None, end_date=None, store_cd=None):
+        """取引件数・売上合計・平均・明細件数"""
+        self._ensure_frames()
+        frame = self._filter(self.transactions, start_date, end_date, store_cd)
+        count = len(frame)
+        total = int(frame["total_amt"].sum()) if count else 0
+        return {
+            "count": count,
+            "total": total,
+            "average": int(total / count) if count else 0,
+            "items": int(frame["items"].sum()) if count else 0,
+        }
+
+    def top_products(self, limit, start_date=None, end_date=None, store_cd=None):
+        """売れ筋商品（販売数の降順）"""
+        self._ensure_frames()
+        frame = self._filter(self.details, start_date, end_date, store_cd)
+        if not len(frame):
+            return []
+        grouped = frame.groupby(["prd_id", "prd_name"], observed=True)["prd_price"].agg(["size", "sum"])
+        grouped = grouped.sort_values("size", ascending=False, kind="stable").head(limit)
+        return [
+            {
+                "prd_id": int(prd_id),
+                "prd_name": prd_name,
+                "sales_count": int(row["size"]),
+                "total_sales": int(row["sum"]),
+            }
+            for (prd_id, prd_name), row in grouped.iterrows()
+        ]
+
+    def slice(self, by, start_date=None, end_date=None, store_cd=None):
+        """
+        指定した次元の組み合わせで取引を集計する
+        by: DIMENSIONS の部分リスト
+        """
+        if not by:
+            raise ValueError("集計する次元を1つ以上指定してください")
+        self._ensure_frames()
+        frame = self._filter(self.transactions, start_date, end_date, store_cd)
+        keys = {}
+        for dim in by:
+            if dim == "day":
+                keys[dim] = frame["datetime"].dt.strftime("%Y-%m-%d")
+            elif dim == "hour":
+                keys[dim] = frame["datetime"].dt.hour
+            elif dim == "weekday":
+                keys[dim] = frame["datetime"].dt.weekday
+            elif dim == "hour_of_week":
+                keys[dim] = frame["datetime"].dt.weekday * 24 + frame["datetime"].dt.hour
+            else:
+                keys[dim] = frame[dim].astype(str)
+        if not len(frame):
+            return []
+
+        values = pd.DataFrame({**keys, "total_amt": frame["total_amt"], "items": frame["items"]})
+        grouped = values.groupby(list(by), observed=True, sort=True).agg(
+            count=("total_amt", "size"),
+            total=("total_amt", "sum"),
+            items=("items", "sum"),
+        ).reset_index()
+        rows = []
+        for record in grouped.to_dict("records"):
+            row = {dim: (int(record[dim]) if isinstance(record[dim], np.integer) else record[dim]) for dim in by}
+            row["count"] = int(record["count"])
+            row["total"] = int(record["total"])
+            row["average"] = int(record["total"] / record["count"]) if record["count"] else 0
+            row["items"] = int(record["items"])
+            rows.append(row)
+        return rows
+
+    def status(self):
+        """スナップショットのメモリ使用量と更新遅延"""
+        self._ensure_frames()
+        age = None if self.refreshed_at is None else time.monotonic() - self.refreshed_at
+        return {
+            "transactions": len(self.transactions),
+            "details": len(self.details),
+            "watermark": self.watermark,
+            "memory_bytes": int(
+                self.transactions.memory_usage(deep=True).sum() + self.details.memory_usage(deep=True).sum()
+            ),
+            "age_seconds": round(age, 3) if age is not None else None,
+            "refresh_interval_seconds": self.refresh_interval,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 4),
+        }
+
+
+# ANALYTICS_ENGINE=1 で有効化（統計APIをスナップショットから応答）
+ANALYTICS_ENGINE_ENABLED = os.getenv('ANALYTICS_ENGINE', '0') == '1'
+
+analytics_snapshot = AnalyticsSnapshot(
+    refresh_interval=float(os.getenv('ANALYTICS_REFRESH_SECONDS', '5')),
+    full_reload_interval=float(os.getenv('ANALYTICS_FULL_RELOAD_SECONDS', '3600')),
+)
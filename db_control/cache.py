@@ -0,0 +1,213 @@
+# db_control/cache.py
+"""
+プロセス内キャッシュ
+
+バーコードスキャン毎の商品マスタ検索（JANコード → 商品）や、ダッシュボードが
+繰り返し問い合わせる統計APIの結果をDBへ往復させないための TTL + LRU キャッシュ。
+キャッシュはワーカープロセス毎に独立しているため、他ワーカーでの更新はTTL経過後に反映される。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+
+# 商品が存在しないことをキャッシュするための番兵
+MISSING = object()
+
+
+class TTLCache:
+    """件数上限付きの TTL + LRU キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """値を取得する。未登録・期限切れの場合は None を返す"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        値を登録する（上限超過時は最も古いものから追い出す）
+        ttl: このエントリのみの有効期間（秒）。float('inf') で期限なし
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """指定キーを削除する"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """値が条件を満たすエントリを削除する（削除件数を返す）"""
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        """全件削除する"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ヒット/ミス/追い出し件数などの統計情報"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def naive_local(value):
+    """タイムゾーン付きの日時をローカル時刻の naive な日時に揃える（取引日時は naive なローカル時刻で保存される）"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class RangeResponseCache:
+    """
+    期間指定付きAPIのレスポンスキャッシュ（エンドポイント毎のTTL・件数上限）
+
+    期間が過去で閉じているエントリは closed_ttl 秒（通常のTTLより長く）保持し、取引の登録・削除時は
+    その取引日時を含む期間のエントリだけを無効化する。無効化は更新を処理したワーカーにしか届かないため、
+    他ワーカーでの削除や過去日時の購入は最大 closed_ttl 秒遅れて反映される。
+
+    分析スナップショットやレプリカから集計した結果は直近の更新を含まないことがあるため、set() には
+    集計に使ったデータの鮮度（as_of、time.monotonic()）を渡す。それ以降にこのワーカーで処理した更新が
+    エントリの期間に含まれる場合は登録しない（無効化直後に古い値で埋め直してTTLの間返し続けるのを防ぐ）。
+    """
+
+    def __init__(self, ttls, maxsize=256, closed_ttl=300.0, write_log_size=1024):
+        self.ttls = ttls
+        self.closed_ttl = closed_ttl
+        self._caches = {name: TTLCache(maxsize=maxsize, ttl=ttl) for name, ttl in ttls.items()}
+        self._writes = deque(maxlen=write_log_size)  # 直近の更新 (time.monotonic(), 取引日時, 店舗コード)
+        self._writes_lock = threading.Lock()
+        self.stale_skips = 0
+
+    @staticmethod
+    def _covers(entry, when, store_cd):
+        """エントリの期間・店舗が日時 when・店舗 store_cd の取引を含み得るか"""
+        return (entry["start"] is None or entry["start"] <= when) \
+            and (entry["end"] is None or when <= entry["end"]) \
+            and (entry["store_cd"] is None or entry["store_cd"] == store_cd)
+
+    def _written_since(self, as_of, entry):
+        """as_of 以降にエントリの期間を含む更新があったか（記録が溢れて判定できない場合も True）"""
+        with self._writes_lock:
+            writes = list(self._writes)
+        for written_at, when, store_cd in reversed(writes):
+            if written_at < as_of:
+                return False
+            if self._covers(entry, when, store_cd):
+                return True
+        return len(writes) == self._writes.maxlen
+
+    def get(self, endpoint, key):
+        entry = self._caches[endpoint].get(key)
+        return None if entry is None else entry["value"]
+
+    def set(self, endpoint, key, value, start=None, end=None, store_cd=None, as_of=None):
+        """
+        start〜end（両端含む、None は無制限）の集計結果を登録する
+        as_of: 集計に使ったデータの鮮度（time.monotonic()、None は最新）。登録しなかった場合は False を返す
+        """
+        start, end = naive_local(start), naive_local(end)
+        entry = {"value": value, "start": start, "end": end, "store_cd": store_cd}
+        if as_of is not None and self._written_since(as_of, entry):
+            self.stale_skips += 1
+            return False
+        closed = end is not None and end < datetime.now()
+        self._caches[endpoint].set(
+            key, entry,
+            ttl=max(self.closed_ttl, self.ttls[endpoint]) if closed else None
+        )
+        return True
+
+    def invalidate(self, when, store_cd):
+        """日時 when・店舗 store_cd の取引を含み得るエントリを無効化する"""
+        when = naive_local(when)
+        with self._writes_lock:
+            self._writes.append((time.monotonic(), when, store_cd))
+        return sum(
+            cache.invalidate_if(lambda entry: self._covers(entry, when, store_cd))
+            for cache in self._caches.values()
+        )
+
+    def stats(self):
+        """エンドポイント毎のヒット率など"""
+        return {name: cache.stats() for name, cache in self._caches.items()}
+
+
+# 商品コード（JAN）をキーとする商品キャッシュ
+# 値は {"prd_id", "code", "name", "price"} の辞書、または MISSING
+# 登録・更新・削除はそれを処理したワーカーのキャッシュにしか反映されないため、他ワーカーや
+# DBへの直接の変更による価格・名称の変更は最大 PRODUCT_CACHE_TTL 秒（既定300秒）古い値で応答し得る。
+# 「見つからない」結果は PRODUCT_CACHE_MISS_TTL 秒（既定5秒）だけ保持し、新規登録された商品はその時間内に見つかる。
+product_cache = TTLCache(
+    maxsize=int(os.getenv('PRODUCT_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('PRODUCT_CACHE_TTL', '300')),
+)
+PRODUCT_CACHE_MISS_TTL = float(os.getenv('PRODUCT_CACHE_MISS_TTL', '5'))
+
+
+def product_to_dict(product):
+    """ProductMaster をキャッシュ用の辞書に変換する"""
+    return {
+        "prd_id": product.prd_id,
+        "code": product.code,
+        "name": product.name,
+        "price": product.price,
+    }
+
+
+# 統計APIのレスポンスキャッシュ（STATISTICS_CACHE=1 で有効化）
+STATISTICS_CACHE_ENABLED = os.getenv('STATISTICS_CACHE', '0') == '1'
+
+statistics_cache = RangeResponseCache(
+    ttls={
+        name: float(os.getenv(f'STATISTICS_CACHE_TTL_{name.upper()}', os.getenv('STATISTICS_CACHE_TTL', '30')))
+        for name in ("sales", "top_products", "hourly_sales", "heatmap", "cube", "distinct")
+    },
+    maxsize=int(os.getenv('STATISTICS_CACHE_SIZE', '256')),
+    closed_ttl=float(os.getenv('STATISTICS_CACHE_CLOSED_TTL', '300')),
+)
@@ -1,10 +1,18 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, StaticPool
+import ssl
 import urllib.parse
 import sys
+import threading
+
+from .pool import pool_settings, primary_engine_count, instrumented_pool, sync_pool_metrics, async_pool_metrics
+from . import sql_log, request_timing
+from .startup import startup_timer
 
 # 環境変数の読み込み
 base_path = Path(__file__).parents[1]  # backendディレクトリへのパス
@@ -19,18 +27,27 @@ DB_HOST = os.getenv('DB_HOST') or os.getenv('APPSETTING_DB_HOST', 'rdbs-002-gen1
 DB_PORT = os.getenv('DB_PORT', '3306')
 DB_NAME = os.getenv('DB_NAME') or os.getenv('APPSETTING_DB_NAME', 'kondo-pos')
 
+# 接続先URLの直接指定（ローカルでのベンチマーク・テスト用の SQLite など）
+#   DATABASE_URL=sqlite:///./pos.db  （ファイル）
+#   DATABASE_URL=sqlite://           （インメモリ）
+# 指定した場合は DB_USER などの接続情報は使わない
+DATABASE_URL_OVERRIDE = os.getenv('DATABASE_URL')
+
 # 環境変数の検証
 missing_vars = []
-if not DB_USER:
-    missing_vars.append('DB_USER')
-if not DB_PASSWORD:
-    missing_vars.append('DB_PASSWORD')
-if not DB_HOST:
-    missing_vars.append('DB_HOST')
-if not DB_NAME:
-    missing_vars.append('DB_NAME')
+if not DATABASE_URL_OVERRIDE:
+    if not DB_USER:
+        missing_vars.append('DB_USER')
+    if not DB_PASSWORD:
+        missing_vars.append('DB_PASSWORD')
+    if not DB_HOST:
+        missing_vars.append('DB_HOST')
+    if not DB_NAME:
+        missing_vars.append('DB_NAME')
 
-if missing_vars:
+
+def _report_missing_settings():
+    """未設定の必須環境変数を案内する（エンジン作成時に1回だけ出力）"""
     error_msg = f"❌ 必須の環境変数が設定されていません: {', '.join(missing_vars)}"
     print(error_msg)
     print("Azure App Serviceの「構成」→「アプリケーション設定」で以下の環境変数を設定してください:")
@@ -45,6 +62,9 @@ if missing_vars:
     print("  - DB_PASSWORD: [データベースのパスワード]")
     print("  - DB_HOST: rdbs-002-gen10-step3-2-oshima5.mysql.database.azure.com")
     print("  - DB_NAME: kondo-pos")
+
+
+if missing_vars:
     # 環境変数が設定されていない場合でもアプリケーションは起動させる
     # （ヘルスチェックで状態を確認できるように）
     DB_USER = DB_USER or 'dummy'
@@ -59,58 +79,166 @@ ssl_cert_path = base_path / 'DigiCertGlobalRootG2.crt.pem'
 encoded_password = urllib.parse.quote_plus(DB_PASSWORD) if DB_PASSWORD else ''
 
 # MySQLのURL構築
-DATABASE_URL = (
+DATABASE_URL = DATABASE_URL_OVERRIDE or (
     f"mysql+pymysql://{DB_USER}:{encoded_password}@"
     f"{DB_HOST}:{DB_PORT}/{DB_NAME}"
     f"?charset=utf8mb4"
 )
 
-# エンジンの作成
-if ssl_cert_path.exists():
-    # SSL証明書がある場合
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={
-            "ssl": {
-                "ssl_ca": str(ssl_cert_path)
-            }
-        },
-        echo=True,  # SQLログ出力（本番環境ではFalse）
-        pool_pre_ping=True,  # 接続の健全性チェック
-        pool_recycle=3600,   # 1時間ごとに接続をリサイクル
-        pool_size=5,
-        max_overflow=10
-    )
-else:
-    # SSL証明書がない場合（開発環境用）
-    print("⚠️  SSL証明書が見つかりません。SSL無しで接続します。")
-    engine = create_engine(
-        DATABASE_URL,
-        echo=True,
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        pool_size=5,
-        max_overflow=10
-    )
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+# インメモリの SQLite は接続ごとに別のDBになるため、1つの接続を共有する
+SQLITE_IN_MEMORY = IS_SQLITE and make_url(DATABASE_URL).database in (None, "", ":memory:")
+
+# 接続プールの設定（環境変数・ワーカー数・同じサーバーに接続するエンジン数から決定）
+POOL_SETTINGS = pool_settings(engines=primary_engine_count())
+
+
+def _sqlite_engine_options(pool_class, metrics):
+    """SQLite 用の create_engine 引数"""
+    if SQLITE_IN_MEMORY:
+        return {
+            "connect_args": {"check_same_thread": False},
+            "poolclass": instrumented_pool(StaticPool, metrics),
+        }
+    return {
+        "connect_args": {"check_same_thread": False},
+        "poolclass": instrumented_pool(pool_class, metrics),
+        **POOL_SETTINGS
+    }
+
+
+def _set_sqlite_pragmas(engine):
+    """外部キー制約を MySQL と同様に有効にし、ファイルの場合は並行アクセス用に WAL にする"""
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        if not SQLITE_IN_MEMORY:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+def _create_engine():
+    if missing_vars:
+        _report_missing_settings()
+
+    if IS_SQLITE:
+        # ローカル検証用（テーブルが無ければ作成する）
+        engine = create_engine(
+            DATABASE_URL,
+            echo=sql_log.SQL_ECHO,
+            **_sqlite_engine_options(QueuePool, sync_pool_metrics)
+        )
+        _set_sqlite_pragmas(engine)
+    elif ssl_cert_path.exists():
+        # SSL証明書がある場合
+        engine = create_engine(
+            DATABASE_URL,
+            connect_args={
+                "ssl": {
+                    "ssl_ca": str(ssl_cert_path)
+                }
+            },
+            echo=sql_log.SQL_ECHO,  # 全SQLの出力は開発時のみ（通常は sql_log のフックで記録）
+            pool_pre_ping=True,  # 接続の健全性チェック
+            poolclass=instrumented_pool(QueuePool, sync_pool_metrics),
+            **POOL_SETTINGS
+        )
+    else:
+        # SSL証明書がない場合（開発環境用）
+        print("⚠️  SSL証明書が見つかりません。SSL無しで接続します。")
+        engine = create_engine(
+            DATABASE_URL,
+            echo=sql_log.SQL_ECHO,
+            pool_pre_ping=True,
+            poolclass=instrumented_pool(QueuePool, sync_pool_metrics),
+            **POOL_SETTINGS
+        )
+
+    sync_pool_metrics.attach(engine)
+    sql_log.attach(engine)
+    request_timing.attach(engine)
+    startup_timer.watch_first_connect(engine)
+    if IS_SQLITE:
+        from . import models  # noqa: F401  全テーブルを Base.metadata に登録する
+        Base.metadata.create_all(bind=engine)
+    return engine
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    同期エンジンを取得する（初回呼び出し時に作成）
+    gunicorn の preload_app では master でアプリを読み込んでから fork するため、
+    接続プールは fork 後の各ワーカーで最初に使うときに作る。
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                with startup_timer.phase("engine_creation"):
+                    _engine = _create_engine()
+    return _engine
+
+
+def dispose_engine_after_fork():
+    """fork 前に作成済みのエンジンがあれば、親プロセスの接続を閉じずにプールを捨てる"""
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+
+def __getattr__(name):
+    # `from db_control.connection import engine` は参照した時点でエンジンを作成する
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Baseクラスの作成
 Base = declarative_base()
 
+
+class LazySessionFactory:
+    """初回呼び出し時にエンジンを作成してセッションを返す sessionmaker"""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._sessionmaker = None
+
+    def __call__(self, **local_kw):
+        if self._sessionmaker is None:
+            self._sessionmaker = sessionmaker(bind=get_engine(), **self._kwargs)
+        return self._sessionmaker(**local_kw)
+
+
 # セッションファクトリの作成
-SessionLocal = sessionmaker(
+SessionLocal = LazySessionFactory(
     autocommit=False,
-    autoflush=False,
-    bind=engine
+    autoflush=False
 )
 
 def test_connection():
     """データベース接続をテストする"""
     try:
         print(f"🔄 データベース接続テスト中...")
-        print(f"   接続情報: {DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-        print(f"   SSL証明書: {'有効' if ssl_cert_path.exists() else '無効'}")
+        if DATABASE_URL_OVERRIDE:
+            print(f"   接続先: {make_url(DATABASE_URL).render_as_string(hide_password=True)}")
+        else:
+            print(f"   接続情報: {DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+            print(f"   SSL証明書: {'有効' if ssl_cert_path.exists() else '無効'}")
         
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
+            if connection.dialect.name == "sqlite":
+                version = connection.execute(text("SELECT sqlite_version()")).scalar()
+                print(f"✅ データベース接続成功!")
+                print(f"   SQLite Version: {version}")
+                print(f"   Database: {connection.engine.url.database or ':memory:'}")
+                return True
+            
             result = connection.execute(text("SELECT VERSION() as version"))
             version = result.fetchone()
             print(f"✅ データベース接続成功!")
@@ -141,3 +269,71 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ===== 非同期DBパス（asyncio + aiomysql） =====
+# DB_ASYNC=1 で有効化。未設定または0の場合は従来の同期セッション（get_db）を使う。
+DB_ASYNC_ENABLED = os.getenv('DB_ASYNC', '0') == '1'
+
+# SQLite の場合は aiosqlite が必要（インメモリは同期エンジンと別のDBになるためファイルを指定すること）
+ASYNC_DATABASE_URL = DATABASE_URL.replace(
+    "mysql+pymysql://", "mysql+aiomysql://", 1
+).replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+def get_async_engine():
+    """非同期エンジンを取得する（初回呼び出し時に作成）"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        if IS_SQLITE:
+            _async_engine = create_async_engine(
+                ASYNC_DATABASE_URL,
+                **_sqlite_engine_options(AsyncAdaptedQueuePool, async_pool_metrics)
+            )
+            _set_sqlite_pragmas(_async_engine.sync_engine)
+        else:
+            connect_args = {}
+            if ssl_cert_path.exists():
+                connect_args["ssl"] = ssl.create_default_context(cafile=str(ssl_cert_path))
+
+            _async_engine = create_async_engine(
+                ASYNC_DATABASE_URL,
+                connect_args=connect_args,
+                pool_pre_ping=True,
+                poolclass=instrumented_pool(AsyncAdaptedQueuePool, async_pool_metrics),
+                **POOL_SETTINGS
+            )
+        async_pool_metrics.attach(_async_engine.sync_engine)
+        sql_log.attach(_async_engine.sync_engine)
+        request_timing.attach(_async_engine.sync_engine)
+        _AsyncSessionLocal = async_sessionmaker(
+            bind=_async_engine,
+            autoflush=False,
+            expire_on_commit=False
+        )
+    return _async_engine
+
+
+async def dispose_async_engine():
+    """非同期エンジンの接続プールを破棄する（終了時処理）"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
+
+async def get_async_db():
+    """非同期データベースセッションを取得"""
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+
+# ハンドラーが依存するセッション（DB_ASYNC で非同期/同期を切り替える）
+get_db_session = get_async_db if DB_ASYNC_ENABLED else get_db
@@ -0,0 +1,335 @@
+# db_control/distinct.py
+"""
+重複なし件数（販売商品数・稼働担当者数・稼働POS機数）の HyperLogLog スケッチ
+
+取引明細への COUNT(DISTINCT ...) を毎回実行する代わりに、店舗×時間 ごとの
+HyperLogLog スケッチを購入処理で更新して distinct_sketches_hourly に保存し、
+参照時は期間内のスケッチをマージして推定する。
+推定値の相対標準誤差は 1.04 / sqrt(2^precision)（precision=12 で約1.6%）。
+
+HyperLogLog は要素を取り除けないため、取引削除はスケッチに反映されない。
+削除後に正確な値が必要な場合は再構築すること:
+    python -m db_control.distinct
+
+DISTINCT_SKETCHES=1 で有効化する。有効化の前にテーブル作成と再構築を行うこと。
+"""
+
+import hashlib
+import math
+import os
+from collections import defaultdict
+
+from sqlalchemy import func, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+
+from .models import Transaction, TransactionDetail, DistinctSketchHourly
+from .rollups import floor_hour
+
+
+DISTINCT_SKETCHES_ENABLED = os.getenv('DISTINCT_SKETCHES', '0') == '1'
+
+# レジスタ数 2^precision（変更した場合は再構築が必要）
+SKETCH_PRECISION = int(os.getenv('DISTINCT_SKETCH_PRECISION', '12'))
+
+# NumPy は読み込みに時間がかかるため、スケッチを初めてマージするときに読み込む
+np = None
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+# 指標名 -> 取引辞書から値を取り出す関数
+METRICS = {
+    "products": lambda txn: (d["prd_id"] for d in txn["details"]),
+    "employees": lambda txn: (txn["emp_cd"],),
+    "terminals": lambda txn: (txn["pos_no"],),
+}
+
+
+class HyperLogLog:
+    """マージ可能な重複なし件数の推定器"""
+
+    def __init__(self, precision=SKETCH_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision は 4〜16 で指定してください")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """保存されたレジスタ列から復元する（レジスタ数から precision を求める）"""
+        return cls(len(data).bit_length() - 1, data)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @property
+    def error_rate(self):
+        """推定値の相対標準誤差"""
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        # 組み込みの hash() はプロセス毎に値が変わるため、保存するスケッチには使えない
+        x = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """other をマージする（レジスタ毎の最大値）"""
+        if other.m != self.m:
+            raise ValueError("precision の異なるスケッチはマージできません")
+        _load_numpy()
+        self.registers = bytearray(np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers, dtype=np.uint8)
+        ).tobytes())
+        return self
+
+    @classmethod
+    def union(cls, registers_list):
+        """保存されたレジスタ列をまとめてマージする（1回の NumPy 演算で最大値を求める）"""
+        registers_list = list(registers_list)
+        size = len(registers_list[0])
+        if any(len(registers) != size for registers in registers_list):
+            raise ValueError("precision の異なるスケッチはマージできません")
+        _load_numpy()
+        stacked = np.frombuffer(b"".join(registers_list), dtype=np.uint8).reshape(len(registers_list), size)
+        return cls.from_bytes(stacked.max(axis=0).tobytes())
+
+    def count(self):
+        """重複なし件数の推定値"""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        _load_numpy()
+        harmonic = float(np.ldexp(1.0, -np.frombuffer(self.registers, dtype=np.uint8).astype(np.int32)).sum())
+        estimate = alpha * m * m / harmonic
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 少数のときは線形カウンティングで補正する
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+# ===== 増分更新 =====
+
+def _transaction_sketches(transaction):
+    sketches = {}
+    for metric, values in METRICS.items():
+        sketch = HyperLogLog()
+        for value in values(transaction):
+            sketch.add(value)
+        sketches[metric] = sketch
+    return sketches
+
+
+def _ensure_rows(db, store_cd, hour_start):
+    """
+    店舗×時間 のスケッチ行が無ければ空のレジスタで作成する（既存行はそのまま）
+    存在しない行への SELECT ... FOR UPDATE はギャップロックになり、同じ時間帯の最初の取引が
+    並行すると InnoDB で INSERT 同士がデッドロックするため、先に行を作ってからロックする。
+    MySQL は INSERT ... ON DUPLICATE KEY UPDATE、SQLite/PostgreSQL は ON CONFLICT DO NOTHING を使う。
+    """
+    table = DistinctSketchHourly.__table__
+    empty = bytes(1 << SKETCH_PRECISION)
+    # 並行トランザクション間のデッドロックを避けるためキー順に並べる
+    rows = [
+        {"store_cd": store_cd, "hour_start": hour_start, "metric": metric, "registers": empty}
+        for metric in sorted(METRICS)
+    ]
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(rows)
+        db.execute(stmt.on_duplicate_key_update(registers=table.c.registers))
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        db.execute(dialect_insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=["store_cd", "hour_start", "metric"]
+        ))
+    else:
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(table).values(row))
+            except IntegrityError:
+                pass
+
+
+def _locked_registers(db, store_cd, hour_start):
+    """店舗×時間 の保存済みスケッチを行ロック付きで読む"""
+    rows = db.query(
+        DistinctSketchHourly.metric, DistinctSketchHourly.registers
+    ).filter(
+        DistinctSketchHourly.store_cd == store_cd,
+        DistinctSketchHourly.hour_start == hour_start
+    ).with_for_update().all()
+    return {metric: registers for metric, registers in rows}
+
+
+def apply_transaction(db, transaction):
+    """
+    1取引分をスケッチへ反映する（コミットは呼び出し側で行う）
+    transaction: insert_transaction() が返す形式の辞書（details を含む）
+    """
+    store_cd = transaction["store_cd"]
+    hour_start = floor_hour(transaction["datetime"])
+    _ensure_rows(db, store_cd, hour_start)
+    stored = _locked_registers(db, store_cd, hour_start)
+
+    for metric, sketch in _transaction_sketches(transaction).items():
+        registers = stored[metric]
+        merged = HyperLogLog.from_bytes(registers).merge(sketch).to_bytes()
+        # 担当者・POS機のスケッチは大半の取引で変化しないため、書き込みを省く
+        if merged != bytes(registers):
+            db.execute(
+                update(DistinctSketchHourly)
+                .where(
+                    DistinctSketchHourly.store_cd == store_cd,
+                    DistinctSketchHourly.hour_start == hour_start,
+                    DistinctSketchHourly.metric == metric
+                )
+                .values(registers=merged)
+            )
+
+
+# ===== 再構築 =====
+
+def rebuild_sketches(db, batch_size=10000):
+    """取引・取引明細からスケッチを作り直す（コミットは呼び出し側で行う）"""
+    sketches = defaultdict(HyperLogLog)  # (store_cd, hour_start, metric) -> HyperLogLog
+
+    headers = db.query(
+        Transaction.datetime, Transaction.store_cd, Transaction.emp_cd, Transaction.pos_no
+    ).yield_per(batch_size)
+    for trd_datetime, store_cd, emp_cd, pos_no in headers:
+        hour_start = floor_hour(trd_datetime)
+        sketches[(store_cd, hour_start, "employees")].add(emp_cd)
+        sketches[(store_cd, hour_start, "terminals")].add(pos_no)
+
+    lines = db.query(
+        Transaction.datetime, Transaction.store_cd, TransactionDetail.prd_id
+    ).join(Transaction).yield_per(batch_size)
+    for trd_datetime, store_cd, prd_id in lines:
+        sketches[(store_cd, floor_hour(trd_datetime), "products")].add(prd_id)
+
+    db.execute(delete(DistinctSketchHourly))
+    rows = [
+        {"store_cd": s, "hour_start": h, "metric": metric, "registers": sketch.to_bytes()}
+        for (s, h, metric), sketch in sketches.items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        db.execute(insert(DistinctSketchHourly), rows[i:i + batch_size])
+
+    return {"distinct_sketches_hourly": len(rows)}
+
+
+# ===== 参照 =====
+
+def distinct_counts(db, lo, hi, by=(), store_cd=None):
+    """
+    [lo, hi) のスケッチをマージした重複なし件数の推定値
+    by: ("store_cd", "day") の部分リスト（指定した単位ごとに推定する）
+    """
+    query = db.query(
+        DistinctSketchHourly.store_cd,
+        DistinctSketchHourly.hour_start,
+        DistinctSketchHourly.metric,
+        DistinctSketchHourly.registers
+    )
+    if lo is not None:
+        query = query.filter(DistinctSketchHourly.hour_start >= lo)
+    if hi is not None:
+        query = query.filter(DistinctSketchHourly.hour_start < hi)
+    if store_cd:
+        query = query.filter(DistinctSketchHourly.store_cd == store_cd)
+
+    groups = defaultdict(lambda: defaultdict(list))  # key -> metric -> [レジスタ列]
+    for row_store_cd, hour_start, metric, registers in query.yield_per(1000):
+        values = {"store_cd": row_store_cd, "day": hour_start.date().isoformat()}
+        groups[tuple(values[dim] for dim in by)][metric].append(bytes(registers))
+
+    return [
+        {
+            **dict(zip(by, key)),
+            **{metric: (HyperLogLog.union(sketches[metric]).count() if metric in sketches else 0) for metric in METRICS}
+        }
+        for key, sketches in sorted(groups.items())
+    ]
+
+
+def exact_distinct_counts(db, start_date=None, end_date=None, by=(), store_cd=None):
+    """COUNT(DISTINCT ...) による厳密な重複なし件数（start_date <= datetime <= end_date）"""
+    dimensions = {
+        "store_cd": Transaction.store_cd,
+        "day": func.date(Transaction.datetime),
+    }
+    keys = [dimensions[dim].label(dim) for dim in by]
+    query = db.query(
+        *keys,
+        func.count(func.distinct(TransactionDetail.prd_id)).label("products"),
+        func.count(func.distinct(Transaction.emp_cd)).label("employees"),
+        func.count(func.distinct(Transaction.pos_no)).label("terminals")
+    ).select_from(Transaction).outerjoin(
+        TransactionDetail, TransactionDetail.trd_id == Transaction.trd_id
+    )
+    if start_date:
+        query = query.filter(Transaction.datetime >= start_date)
+    if end_date:
+        query = query.filter(Transaction.datetime <= end_date)
+    if store_cd:
+        query = query.filter(Transaction.store_cd == store_cd)
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+
+    rows = []
+    for r in query.all():
+        if not r.employees:
+            continue
+        row = {dim: str(getattr(r, dim)) for dim in by}
+        row.update({metric: int(getattr(r, metric)) for metric in METRICS})
+        rows.append(row)
+    return rows
+
+
+def main():
+    """スケッチテーブルを作成して再構築する"""
+    from .connection import engine, SessionLocal
+
+    print("=" * 60)
+    print("🔢 重複なし件数スケッチ再構築開始")
+    print("=" * 60)
+
+    DistinctSketchHourly.__table__.create(bind=engine, checkfirst=True)
+
+    session = SessionLocal()
+    try:
+        counts = rebuild_sketches(session)
+        session.commit()
+        for table, count in counts.items():
+            print(f"   - {table}: {count}行")
+        print("✅ 重複なし件数スケッチの再構築に成功しました")
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"❌ 再構築エラー: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# db_control/export.py
+"""
+取引履歴のストリーミングエクスポート（NDJSON / CSV）
+
+サーバーサイドカーソル（stream_results）で取引と明細を trd_id 順に読み、
+取引ごとに明細をまとめながら逐次出力する。ORM オブジェクトや全件のリストを
+作らないため、出力件数に関わらずメモリ使用量は一定。
+"""
+
+import csv
+import io
+import json
+from itertools import groupby
+
+from sqlalchemy import select
+
+from .models import Transaction, TransactionDetail
+
+
+HEADER_FIELDS = ["trd_id", "datetime", "emp_cd", "store_cd", "pos_no", "total_amt"]
+DETAIL_FIELDS = ["dtl_id", "prd_id", "prd_code", "prd_name", "prd_price"]
+
+# 1回の yield にまとめる行数（小さすぎると送信回数が増え、大きすぎると最初の応答が遅れる）
+CHUNK_ROWS = 500
+
+
+def _export_statement(start_date=None, end_date=None, store_cd=None):
+    stmt = select(
+        Transaction.trd_id, Transaction.datetime, Transaction.emp_cd,
+        Transaction.store_cd, Transaction.pos_no, Transaction.total_amt,
+        TransactionDetail.dtl_id, TransactionDetail.prd_id, TransactionDetail.prd_code,
+        TransactionDetail.prd_name, TransactionDetail.prd_price
+    ).select_from(Transaction).outerjoin(
+        TransactionDetail, TransactionDetail.trd_id == Transaction.trd_id
+    )
+    if start_date:
+        stmt = stmt.where(Transaction.datetime >= start_date)
+    if end_date:
+        stmt = stmt.where(Transaction.datetime <= end_date)
+    if store_cd:
+        stmt = stmt.where(Transaction.store_cd == store_cd)
+    return stmt.order_by(Transaction.trd_id, TransactionDetail.dtl_id)
+
+
+def _stream_rows(session_factory, start_date, end_date, store_cd, batch_size):
+    db = session_factory()
+    try:
+        result = db.execute(
+            _export_statement(start_date, end_date, store_cd).execution_options(
+                stream_results=True,
+                yield_per=batch_size
+            )
+        )
+        yield from result
+    finally:
+        db.close()
+
+
+def iter_ndjson(session_factory, start_date=None, end_date=None, store_cd=None, batch_size=1000):
+    """1行1取引（明細を details に含む）の NDJSON を逐次生成する"""
+    rows = _stream_rows(session_factory, start_date, end_date, store_cd, batch_size)
+    lines = []
+    for trd_id, group in groupby(rows, key=lambda row: row.trd_id):
+        first = next(group)
+        header = {field: getattr(first, field) for field in HEADER_FIELDS}
+        header["datetime"] = header["datetime"].isoformat()
+        header["details"] = [
+            {field: getattr(row, field) for field in DETAIL_FIELDS}
+            for row in (first, *group) if row.dtl_id is not None
+        ]
+        lines.append(json.dumps(header, ensure_ascii=False))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def iter_csv(session_factory, start_date=None, end_date=None, store_cd=None, batch_size=1000):
+    """1行1明細（取引ヘッダー列を含む）の CSV を逐次生成する"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER_FIELDS + DETAIL_FIELDS)
+    count = 0
+    for row in _stream_rows(session_factory, start_date, end_date, store_cd, batch_size):
+        values = list(row)
+        values[1] = values[1].isoformat()
+        writer.writerow(values)
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
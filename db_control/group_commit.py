@@ -0,0 +1,147 @@
+# db_control/group_commit.py
+"""
+購入のグループコミット
+
+チェックアウトが集中する時間帯は、購入1件ごとのコミット（= fsync）がボトルネックになる。
+同一ワーカー内で短い時間窓に集まった購入をまとめて1つのDBトランザクションで書き込み、
+各呼び出し元にはそれぞれの結果を返す。
+
+失敗は購入単位で分離する:
+  - 商品が存在しない購入はその購入だけを失敗とし、他の購入は書き込む
+  - まとめて書き込み中にDBエラーが発生した場合はロールバックし、
+    その窓の購入を1件ずつ個別のトランザクションで書き直す
+"""
+
+import asyncio
+import os
+
+from .purchase import find_missing_products, insert_transaction
+
+
+class GroupCommitter:
+    """購入をまとめて1トランザクションで書き込むバッチャー"""
+
+    def __init__(self, session_factory, window_ms=5.0, max_batch=100):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+        self._loop = None
+        self.batches = 0
+        self.purchases = 0
+        self.fallbacks = 0
+
+    async def submit(self, purchase):
+        """
+        購入を登録待ちに追加し、書き込み完了まで待つ
+        purchase: emp_cd / store_cd / pos_no / details を持つ辞書
+        リターン: 登録した取引の辞書（失敗時は None）
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((purchase, future))
+        return await future
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def close(self):
+        """ワーカーを停止する（待機中の購入は書き込んでから停止）"""
+        if self._worker is None:
+            return
+        while not self._queue.empty():
+            await asyncio.sleep(self.window)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            purchases = [purchase for purchase, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self._write_batch, purchases)
+            except Exception as e:
+                print(f"グループコミットエラー: {e}")
+                results = [None] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _write_batch(self, purchases):
+        """購入のリストを1トランザクションで書き込む（ワーカースレッドで実行）"""
+        self.batches += 1
+        self.purchases += len(purchases)
+        db = self.session_factory()
+        try:
+            missing = find_missing_products(
+                db, [d["prd_id"] for p in purchases for d in p["details"]]
+            )
+            results = []
+            for purchase in purchases:
+                if any(d["prd_id"] in missing for d in purchase["details"]):
+                    results.append(None)
+                else:
+                    results.append(insert_transaction(db, **purchase))
+            db.commit()
+            return results
+        except Exception as e:
+            db.rollback()
+            print(f"グループコミット失敗、個別に書き直します: {e}")
+            self.fallbacks += 1
+        finally:
+            db.close()
+
+        return [self._write_one(purchase) for purchase in purchases]
+
+    def _write_one(self, purchase):
+        db = self.session_factory()
+        try:
+            if find_missing_products(db, [d["prd_id"] for d in purchase["details"]]):
+                return None
+            transaction = insert_transaction(db, **purchase)
+            db.commit()
+            return transaction
+        except Exception as e:
+            db.rollback()
+            print(f"購入処理エラー: {e}")
+            return None
+        finally:
+            db.close()
+
+    def stats(self):
+        """バッチ数・購入数・平均バッチサイズ"""
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "purchases": self.purchases,
+            "average_batch_size": round(self.purchases / self.batches, 2) if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# PURCHASE_GROUP_COMMIT=1 で有効化（既定は購入ごとにコミット）
+PURCHASE_GROUP_COMMIT_ENABLED = os.getenv('PURCHASE_GROUP_COMMIT', '0') == '1'
+PURCHASE_GROUP_COMMIT_WINDOW_MS = float(os.getenv('PURCHASE_GROUP_COMMIT_WINDOW_MS', '5'))
+PURCHASE_GROUP_COMMIT_MAX_BATCH = int(os.getenv('PURCHASE_GROUP_COMMIT_MAX_BATCH', '100'))
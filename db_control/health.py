@@ -0,0 +1,103 @@
+# db_control/health.py
+"""
+バックグラウンドのDB死活監視
+
+ヘルスチェックのたびに接続を借りてSQLを実行すると、頻繁な死活監視が
+接続プールの枠とイベントループを占有する。代わりに一定間隔でDBへ SELECT 1 を
+発行し、結果（成否・応答時間・最後のエラー）を保持してヘルスチェックから返す。
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+
+HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '10'))
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', '5'))
+
+
+class DatabaseProber:
+    """一定間隔でDBへの接続を確認し、最新の状態を保持する"""
+
+    def __init__(self, engine_factory, interval=10.0, timeout=5.0):
+        self.engine_factory = engine_factory
+        self.interval = interval
+        self.timeout = timeout
+        self.ok = None  # 初回の確認が終わるまでは None
+        self.latency_ms = None
+        self.checked_at = None
+        self.last_ok_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self.consecutive_failures = 0
+        self._task = None
+
+    def _probe(self):
+        started = time.perf_counter()
+        with self.engine_factory().connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return (time.perf_counter() - started) * 1000
+
+    async def probe(self):
+        """1回確認する（タイムアウト時は失敗として記録し、スレッドの完了は待たない）"""
+        try:
+            latency_ms = await asyncio.wait_for(asyncio.to_thread(self._probe), self.timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError(f"{self.timeout}秒以内に応答がありません")
+            self.ok = False
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.last_error_at = datetime.now()
+            self.consecutive_failures += 1
+        else:
+            self.ok = True
+            self.latency_ms = latency_ms
+            self.last_ok_at = datetime.now()
+            self.consecutive_failures = 0
+        self.checked_at = time.monotonic()
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """監視タスクを開始する（実行中のイベントループ上で呼ぶ）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def stale(self):
+        """確認結果が古すぎる（監視タスクが止まっている）か"""
+        if self.checked_at is None:
+            return True
+        return time.monotonic() - self.checked_at > self.interval * 3 + self.timeout
+
+    @property
+    def ready(self):
+        return bool(self.ok) and not self.stale
+
+    def status(self):
+        age = None if self.checked_at is None else time.monotonic() - self.checked_at
+        return {
+            "ok": self.ok,
+            "latency_ms": round(self.latency_ms, 3) if self.latency_ms is not None else None,
+            "checked_seconds_ago": round(age, 3) if age is not None else None,
+            "last_ok_at": self.last_ok_at.isoformat() if self.last_ok_at else None,
+            "last_error": self.last_error,
+            "last_error_at": self.last_error_at.isoformat() if self.last_error_at else None,
+            "consecutive_failures": self.consecutive_failures,
+            "interval_seconds": self.interval,
+        }
@@ -1,7 +1,7 @@
 ﻿# db_control/models.py
 
 from sqlalchemy import (
-    Column, Integer, String, DateTime,
+    Column, Integer, String, Date, DateTime, LargeBinary,
     ForeignKey, Index
 )
 from sqlalchemy.orm import relationship
@@ -62,3 +62,52 @@ class TransactionDetail(Base):
     transaction = relationship("Transaction", back_populates="details")
 
     __table_args__ = (Index("ix_transaction_details_prd_id", "prd_id"),)
+
+
+# ===== 売上集計（ロールアップ）テーブル =====
+# 購入・取引削除時に増分更新し、統計APIは生の取引行ではなくこれらを集計する。
+
+# 時間別売上（店舗 × 1時間）
+class SalesHourly(Base):
+    __tablename__ = "sales_hourly"
+
+    store_cd = Column(String(5), primary_key=True, comment="店舗コード")
+    hour_start = Column(DateTime, primary_key=True, comment="集計時間帯の開始日時")
+    txn_count = Column(Integer, nullable=False, default=0, comment="取引件数")
+    total_amt = Column(Integer, nullable=False, default=0, comment="売上合計")
+    item_count = Column(Integer, nullable=False, default=0, comment="明細件数")
+
+
+# 日別売上（店舗 × 1日）
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+
+    store_cd = Column(String(5), primary_key=True, comment="店舗コード")
+    sales_date = Column(Date, primary_key=True, comment="売上日")
+    txn_count = Column(Integer, nullable=False, default=0, comment="取引件数")
+    total_amt = Column(Integer, nullable=False, default=0, comment="売上合計")
+    item_count = Column(Integer, nullable=False, default=0, comment="明細件数")
+
+
+# 商品別日別売上（店舗 × 1日 × 商品）
+class ProductSalesDaily(Base):
+    __tablename__ = "product_sales_daily"
+
+    sales_date = Column(Date, primary_key=True, comment="売上日")
+    store_cd = Column(String(5), primary_key=True, comment="店舗コード")
+    prd_id = Column(Integer, primary_key=True, comment="商品一意キー")
+    prd_name = Column(String(50), primary_key=True, comment="商品名称")
+    sales_count = Column(Integer, nullable=False, default=0, comment="販売数")
+    total_sales = Column(Integer, nullable=False, default=0, comment="売上合計")
+
+    __table_args__ = (Index("ix_product_sales_daily_prd_id", "prd_id"),)
+
+
+# 重複なし件数スケッチ（店舗 × 1時間 × 指標、HyperLogLog のレジスタ列）
+class DistinctSketchHourly(Base):
+    __tablename__ = "distinct_sketches_hourly"
+
+    store_cd = Column(String(5), primary_key=True, comment="店舗コード")
+    hour_start = Column(DateTime, primary_key=True, comment="集計時間帯の開始日時")
+    metric = Column(String(10), primary_key=True, comment="指標（products / employees / terminals）")
+    registers = Column(LargeBinary, nullable=False, comment="HyperLogLog レジスタ")
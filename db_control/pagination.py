@@ -0,0 +1,31 @@
+# db_control/pagination.py
+"""
+キーセット（カーソル）ページネーション用のカーソル
+
+カーソルはクライアントからは不透明な文字列（JSON を URL-safe Base64 化したもの）。
+"""
+
+import base64
+import json
+
+
+class InvalidCursorError(ValueError):
+    """カーソルが不正な場合の例外"""
+
+
+def encode_cursor(values):
+    """シーク位置（辞書）をカーソル文字列に変換する"""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソル文字列をシーク位置（辞書）に戻す"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursorError(f"不正なカーソルです: {cursor}") from e
+    if not isinstance(values, dict):
+        raise InvalidCursorError(f"不正なカーソルです: {cursor}")
+    return values
@@ -0,0 +1,206 @@
+# db_control/pool.py
+"""
+接続プールのサイズ設定と計測
+
+プールサイズは環境変数で指定するか、DB全体の接続数の上限（DB_MAX_CONNECTIONS）を
+gunicorn のワーカー数と、同じDBサーバーに接続するエンジンの数で割って決める。
+Azure Database for MySQL の接続数上限を ワーカー数 × エンジン数 × (pool_size + max_overflow)
+が超えないようにするため。エンジンは同期エンジンと DB_ASYNC=1 の非同期エンジン、
+リードレプリカは DB_REPLICA_MAX_CONNECTIONS（レプリカ側の上限）が未指定ならプライマリと同じ上限を分け合う。
+
+プールは計測付きのサブクラスで作成し、貸し出し待ち時間のヒストグラム・
+オーバーフロー使用数・接続の作成/破棄数（チャーン）をワーカー毎に集計する。
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from .request_timing import observe_pool_wait
+
+
+# 貸し出し待ち時間ヒストグラムの区切り（ミリ秒、上限値を含む）
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def worker_count():
+    """gunicorn のワーカー数（gunicorn.conf.py が GUNICORN_WORKERS に設定する）"""
+    value = os.getenv('GUNICORN_WORKERS') or os.getenv('WEB_CONCURRENCY')
+    if value:
+        return max(int(value), 1)
+    return min(multiprocessing.cpu_count(), 2)
+
+
+def replica_has_own_budget():
+    """リードレプリカが別サーバーとして接続数上限（DB_REPLICA_MAX_CONNECTIONS）を持つか"""
+    return bool(os.getenv('DB_REPLICA_MAX_CONNECTIONS'))
+
+
+def primary_engine_count():
+    """プライマリの接続数上限を分け合うエンジンの数（ワーカー毎）"""
+    engines = 1  # 同期エンジン（DB_ASYNC=1 でも書き込み・バックグラウンド処理で使う）
+    if os.getenv('DB_ASYNC', '0') == '1':
+        engines += 1
+    replica = os.getenv('DB_REPLICA_URL') or os.getenv('DB_REPLICA_HOST') or os.getenv('APPSETTING_DB_REPLICA_HOST')
+    if replica and not replica_has_own_budget():
+        engines += 1
+    return engines
+
+
+def pool_settings(engines=1, budget=None):
+    """
+    create_engine に渡す1エンジン分のプール設定
+    DB_POOL_SIZE / DB_MAX_OVERFLOW が指定されていればそれを使い（エンジン毎の値）、
+    接続数の上限 budget（未指定時は DB_MAX_CONNECTIONS）があれば ワーカー数 × engines で割った数を
+    pool_size と max_overflow に分ける。どちらも無い場合は従来どおり 5 + 10。
+    """
+    pool_size = os.getenv('DB_POOL_SIZE')
+    max_overflow = os.getenv('DB_MAX_OVERFLOW')
+    budget = budget or os.getenv('DB_MAX_CONNECTIONS')
+
+    if pool_size is None and max_overflow is None and budget:
+        per_engine = max(int(budget) // (worker_count() * engines), 1)
+        pool_size = max(per_engine // 2, 1)
+        max_overflow = per_engine - pool_size
+    else:
+        pool_size = int(pool_size or 5)
+        max_overflow = int(max_overflow if max_overflow is not None else 10)
+
+    return {
+        "pool_size": int(pool_size),
+        "max_overflow": int(max_overflow),
+        "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', '3600')),
+        "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    }
+
+
+class PoolMetrics:
+    """1つの接続プールの計測値（スレッドセーフ）"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_timeouts = 0
+            self.wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.overflow_checkouts = 0
+            self.peak_checked_out = 0
+            self.connections_opened = 0
+            self.connections_closed = 0
+            self.connections_invalidated = 0
+
+    def observe_checkout(self, wait_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            for i, bound in enumerate(WAIT_BUCKETS_MS):
+                if wait_ms <= bound:
+                    self.wait_counts[i] += 1
+                    break
+            else:
+                self.wait_counts[-1] += 1
+            pool = self.pool
+            if pool is not None and hasattr(pool, "checkedout"):
+                self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+                if pool.overflow() > 0:
+                    self.overflow_checkouts += 1
+
+    def attach(self, engine):
+        """エンジンの接続イベント（作成・破棄・無効化）を購読する"""
+        self.pool = engine.pool
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                self.connections_opened += 1
+
+        @event.listens_for(engine, "close")
+        def on_close(dbapi_connection, connection_record):
+            with self._lock:
+                self.connections_closed += 1
+
+        @event.listens_for(engine, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            with self._lock:
+                self.connections_invalidated += 1
+
+        @event.listens_for(engine, "engine_disposed")
+        def on_disposed(disposed_engine):
+            self.pool = disposed_engine.pool
+
+    def stats(self):
+        pool = self.pool
+        with self._lock:
+            histogram = {
+                f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_counts)
+            }
+            histogram["gt_5000ms"] = self.wait_counts[-1]
+            stats = {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+                "wait_ms": {
+                    "average": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                    "max": round(self.wait_max_ms, 3),
+                    "histogram": histogram,
+                },
+                "churn": {
+                    "opened": self.connections_opened,
+                    "closed": self.connections_closed,
+                    "invalidated": self.connections_invalidated,
+                },
+            }
+        if pool is not None and hasattr(pool, "checkedout"):  # StaticPool（インメモリ SQLite）は除く
+            stats.update(
+                pool_size=pool.size(),
+                max_overflow=getattr(pool, "_max_overflow", None),
+                timeout=pool.timeout() if hasattr(pool, "timeout") else None,
+                checked_out=pool.checkedout(),
+                idle=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+            )
+        return stats
+
+
+def instrumented_pool(pool_class, metrics):
+    """
+    貸し出し待ち時間を計測するプールクラスを作る
+    dispose() で作り直されるプールも self.__class__ で作られるため計測は引き継がれる。
+    """
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.observe_checkout((time.perf_counter() - started) * 1000, timed_out=True)
+                raise
+            wait_ms = (time.perf_counter() - started) * 1000
+            metrics.observe_checkout(wait_ms)
+            observe_pool_wait(wait_ms)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+# 同期エンジン・非同期エンジン・レプリカのプール計測値
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+replica_pool_metrics = PoolMetrics("replica")
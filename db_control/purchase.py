@@ -0,0 +1,114 @@
+# db_control/purchase.py
+"""
+取引登録（購入）の書き込み処理
+
+明細の件数に関わらず、DBへの往復を定数回に抑える:
+  1. 商品存在チェック   SELECT ... WHERE prd_id IN (...)  （1回）
+  2. 取引テーブルへ登録 INSERT INTO transactions           （1回、合計金額は事前計算）
+  3. 取引明細へ登録     複数行 INSERT INTO transaction_details（1回）
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete
+
+from .models import Transaction, TransactionDetail
+from .statements import fetch_existing_product_ids, INSERT_TRANSACTION, INSERT_TRANSACTION_DETAILS
+from .rollups import SALES_ROLLUPS_ENABLED, apply_transaction
+from .distinct import DISTINCT_SKETCHES_ENABLED, apply_transaction as apply_distinct_sketches
+
+
+def find_missing_products(db, prd_ids):
+    """存在しない商品IDの集合を返す（1クエリ）"""
+    wanted = set(prd_ids)
+    if not wanted:
+        return set()
+    return wanted - fetch_existing_product_ids(db, wanted)
+
+
+def insert_transaction(db, emp_cd, store_cd, pos_no, details, trd_datetime=None):
+    """
+    取引と取引明細を登録する（コミットは呼び出し側で行う）
+    details: prd_id / prd_code / prd_name / prd_price を持つ辞書のリスト
+    リターン: 登録した取引の辞書（trd_id / datetime / ... / total_amt / details）
+    """
+    trd_datetime = trd_datetime or datetime.now()
+    total_amount = sum(d["prd_price"] for d in details)
+
+    result = db.execute(
+        INSERT_TRANSACTION,
+        {
+            "datetime": trd_datetime,
+            "emp_cd": emp_cd,
+            "store_cd": store_cd,
+            "pos_no": pos_no,
+            "total_amt": total_amount,
+        }
+    )
+    trd_id = result.inserted_primary_key[0]
+
+    rows = [
+        {
+            "trd_id": trd_id,
+            "dtl_id": idx,
+            "prd_id": d["prd_id"],
+            "prd_code": d["prd_code"],
+            "prd_name": d["prd_name"],
+            "prd_price": d["prd_price"],
+        }
+        for idx, d in enumerate(details, start=1)
+    ]
+    db.execute(INSERT_TRANSACTION_DETAILS, rows)
+
+    transaction = {
+        "trd_id": trd_id,
+        "datetime": trd_datetime,
+        "emp_cd": emp_cd,
+        "store_cd": store_cd,
+        "pos_no": pos_no,
+        "total_amt": total_amount,
+        "details": rows,
+    }
+    if SALES_ROLLUPS_ENABLED:
+        apply_transaction(db, transaction)
+    if DISTINCT_SKETCHES_ENABLED:
+        apply_distinct_sketches(db, transaction)
+
+    return transaction
+
+
+def delete_transaction(db, trd_id):
+    """
+    取引と取引明細を削除する（コミットは呼び出し側で行う）
+    リターン: 削除した取引の辞書（存在しない場合は None）
+    """
+    header = db.query(
+        Transaction.trd_id,
+        Transaction.datetime,
+        Transaction.emp_cd,
+        Transaction.store_cd,
+        Transaction.pos_no,
+        Transaction.total_amt
+    ).filter(Transaction.trd_id == trd_id).first()
+    if header is None:
+        return None
+
+    transaction = header._asdict()
+    transaction["details"] = [
+        row._asdict()
+        for row in db.query(
+            TransactionDetail.trd_id,
+            TransactionDetail.dtl_id,
+            TransactionDetail.prd_id,
+            TransactionDetail.prd_code,
+            TransactionDetail.prd_name,
+            TransactionDetail.prd_price
+        ).filter(TransactionDetail.trd_id == trd_id).all()
+    ]
+
+    db.execute(delete(TransactionDetail).where(TransactionDetail.trd_id == trd_id))
+    db.execute(delete(Transaction).where(Transaction.trd_id == trd_id))
+    if SALES_ROLLUPS_ENABLED:
+        apply_transaction(db, transaction, sign=-1)
+
+    return transaction
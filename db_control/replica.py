@@ -0,0 +1,236 @@
+# db_control/replica.py
+"""
+読み取り専用レプリカへの振り分け
+
+統計・取引一覧などの読み取り専用APIを、購入処理の書き込みと競合しないよう
+リードレプリカへ送る。レプリカの遅延（Seconds_Behind_Source）が上限を超えた場合や
+接続できない場合はプライマリへフォールバックする。
+
+DB_REPLICA_HOST（または DB_REPLICA_URL）を設定すると有効になる。
+ローカルでの確認には2つ目の MySQL / SQLite を DB_REPLICA_URL に指定すればよい。
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from fastapi import Request
+
+from .connection import (
+    DB_USER, encoded_password, DB_PORT, DB_NAME, ssl_cert_path,
+    POOL_SETTINGS, SessionLocal, get_async_db, DB_ASYNC_ENABLED
+)
+from .pool import pool_settings, replica_has_own_budget, instrumented_pool, replica_pool_metrics
+from . import sql_log, request_timing
+
+
+DB_REPLICA_HOST = os.getenv('DB_REPLICA_HOST') or os.getenv('APPSETTING_DB_REPLICA_HOST')
+DB_REPLICA_PORT = os.getenv('DB_REPLICA_PORT', DB_PORT)
+
+# 完全なURLを指定する場合（ローカル検証用の SQLite など）
+DB_REPLICA_URL = os.getenv('DB_REPLICA_URL') or (
+    f"mysql+pymysql://{DB_USER}:{encoded_password}@"
+    f"{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    f"?charset=utf8mb4"
+    if DB_REPLICA_HOST else None
+)
+
+DB_REPLICA_ENABLED = DB_REPLICA_URL is not None
+
+# レプリカのプール設定（DB_REPLICA_MAX_CONNECTIONS 未指定時はプライマリの上限を分け合う設定をそのまま使う）
+REPLICA_POOL_SETTINGS = (
+    pool_settings(budget=os.getenv('DB_REPLICA_MAX_CONNECTIONS'))
+    if replica_has_own_budget() else POOL_SETTINGS
+)
+
+# 許容する遅延（秒）と遅延の確認間隔（秒）
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', '5'))
+
+# 常にプライマリを使うエンドポイント（ルートのパスをカンマ区切りで指定）
+DB_REPLICA_EXCLUDE = {
+    path.strip() for path in os.getenv('DB_REPLICA_EXCLUDE', '').split(',') if path.strip()
+}
+
+_replica_engine = None
+_ReplicaSessionLocal = None
+_engine_lock = threading.Lock()
+
+
+def get_replica_engine():
+    """レプリカのエンジンを取得する（初回呼び出し時に作成）"""
+    global _replica_engine, _ReplicaSessionLocal
+    with _engine_lock:
+        if _replica_engine is None:
+            connect_args = {}
+            if DB_REPLICA_URL.startswith("mysql") and ssl_cert_path.exists():
+                connect_args["ssl"] = {"ssl_ca": str(ssl_cert_path)}
+            _replica_engine = create_engine(
+                DB_REPLICA_URL,
+                connect_args=connect_args,
+                echo=sql_log.SQL_ECHO,
+                pool_pre_ping=True,
+                poolclass=instrumented_pool(QueuePool, replica_pool_metrics),
+                **REPLICA_POOL_SETTINGS
+            )
+            replica_pool_metrics.attach(_replica_engine)
+            sql_log.attach(_replica_engine)
+            request_timing.attach(_replica_engine)
+            _ReplicaSessionLocal = sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                bind=_replica_engine
+            )
+    return _replica_engine
+
+
+def replica_lag_seconds(connection):
+    """
+    レプリカの遅延（秒）
+    MySQL 以外（検証用の SQLite など）とレプリケーション未設定のサーバーは 0、
+    レプリケーションが停止している場合は None を返す。
+    """
+    if connection.dialect.name != "mysql":
+        return 0.0
+    for statement, column in (
+        ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),  # MySQL 8.0.22 以降
+        ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+    ):
+        try:
+            row = connection.execute(text(statement)).mappings().first()
+        except DBAPIError:
+            continue
+        if row is None:
+            return 0.0
+        value = row.get(column)
+        return None if value is None else float(value)
+    return None
+
+
+class ReplicaRouter:
+    """レプリカの遅延を定期的に確認し、読み取りの振り分け先を決める"""
+
+    def __init__(self, max_lag_seconds=5.0, check_interval=5.0):
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.lag_seconds = None
+        self.error = None
+        self.checked_at = None
+        self.replica_reads = 0
+        self.fallbacks = 0
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """レプリカの遅延を確認する（ブロッキング）"""
+        try:
+            with get_replica_engine().connect() as connection:
+                lag = replica_lag_seconds(connection)
+            error = None if lag is not None else "replication stopped"
+        except Exception as e:
+            lag, error = None, f"{type(e).__name__}: {e}"
+        with self._lock:
+            self.lag_seconds = lag
+            self.error = error
+            self.checked_at = time.monotonic()
+            self._checking = False
+
+    def _due(self):
+        with self._lock:
+            if self._checking:
+                return False
+            if self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval:
+                self._checking = True
+                return True
+            return False
+
+    async def use_replica(self, max_lag_seconds=None):
+        """レプリカを使えるか（確認間隔が過ぎていればスレッドで遅延を確認してから判定する）"""
+        if not DB_REPLICA_ENABLED:
+            return False
+        if self._due():
+            await asyncio.to_thread(self.check)
+        limit = self.max_lag_seconds if max_lag_seconds is None else max_lag_seconds
+        lag = self.lag_seconds
+        ok = lag is not None and lag <= limit
+        with self._lock:
+            if ok:
+                self.replica_reads += 1
+            else:
+                self.fallbacks += 1
+        return ok
+
+    def status(self):
+        age = None if self.checked_at is None else time.monotonic() - self.checked_at
+        return {
+            "enabled": DB_REPLICA_ENABLED,
+            "max_lag_seconds": self.max_lag_seconds,
+            "lag_seconds": self.lag_seconds,
+            "error": self.error,
+            "checked_seconds_ago": round(age, 3) if age is not None else None,
+            "replica_reads": self.replica_reads,
+            "fallbacks": self.fallbacks,
+            "excluded_endpoints": sorted(DB_REPLICA_EXCLUDE),
+        }
+
+
+replica_router = ReplicaRouter(
+    max_lag_seconds=DB_REPLICA_MAX_LAG_SECONDS,
+    check_interval=DB_REPLICA_LAG_CHECK_SECONDS,
+)
+
+
+def is_replica_session(db):
+    """レプリカに接続したセッションか"""
+    return _replica_engine is not None and getattr(db, "bind", None) is _replica_engine
+
+
+def _excluded(request):
+    """DB_REPLICA_EXCLUDE で常にプライマリを使うよう指定されたエンドポイントか"""
+    route = request.scope.get("route") if request is not None else None
+    return route is not None and route.path in DB_REPLICA_EXCLUDE
+
+
+async def read_session_factory(max_lag_seconds=None, request=None):
+    """
+    読み取り用のセッションファクトリ（レプリカを使えない場合はプライマリ）
+    request を渡すと DB_REPLICA_EXCLUDE に含まれるエンドポイントは常にプライマリを使う。
+    """
+    if not _excluded(request) and await replica_router.use_replica(max_lag_seconds):
+        return _ReplicaSessionLocal
+    return SessionLocal
+
+
+def read_db(max_lag_seconds=None):
+    """
+    読み取り専用ハンドラー用のセッション依存関係を作る
+    max_lag_seconds: このエンドポイントで許容する遅延（None は DB_REPLICA_MAX_LAG_SECONDS）
+    DB_REPLICA_EXCLUDE に含まれるエンドポイントは常にプライマリを使う。
+    """
+    async def dependency(request: Request):
+        if DB_REPLICA_ENABLED and not _excluded(request) and await replica_router.use_replica(max_lag_seconds):
+            db = _ReplicaSessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+        elif DB_ASYNC_ENABLED:
+            async for db in get_async_db():
+                yield db
+        else:
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+    return dependency
+
+
+# 読み取り専用ハンドラーの標準のセッション
+get_read_db = read_db()
@@ -0,0 +1,239 @@
+# db_control/request_timing.py
+"""
+リクエスト毎の処理時間の内訳
+
+遅い /api/purchase が、リクエストの検証（Pydantic）・接続プールの貸し出し待ち・SQL・
+レスポンスのシリアライズのどこで時間を使っているかを切り分けるため、サンプリングした
+リクエストについて以下を記録し、Server-Timing ヘッダーと構造化ログ（JSON 1行）で出力する。
+  - total:     ミドルウェアに入ってからレスポンスヘッダー送信まで
+  - validate:  ルーティング後、エンドポイント関数の呼び出しまで（パラメータ・ボディの検証と依存関係の解決）
+  - app:       エンドポイント関数の実行（db / pool を含む）
+  - db:        SQLの実行時間と件数（エンジンのイベントフック）
+  - pool:      接続プールの貸し出し待ち時間
+  - serialize: エンドポイントの戻り値をレスポンスに変換するまで（response_model の検証・JSON化）
+
+計測値は contextvars でリクエスト毎に保持するため、スレッドプールや run_sync の中で
+実行されたSQLも元のリクエストに集計される。REQUEST_TIMING=0（既定）ではフックを登録しない。
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING', '0') == '1'
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', '0.1'))
+
+logger = logging.getLogger("pos.request")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class RequestTiming:
+    """1リクエストの計測値（時刻は perf_counter の秒、時間はミリ秒）"""
+
+    __slots__ = (
+        "started", "finished", "sql_count", "sql_ms", "pool_checkouts", "pool_wait_ms",
+        "handler_started", "handler_finished", "endpoint_started", "endpoint_finished",
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = False
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.pool_checkouts = 0
+        self.pool_wait_ms = 0.0
+        self.handler_started = None
+        self.handler_finished = None
+        self.endpoint_started = None
+        self.endpoint_finished = None
+
+    @staticmethod
+    def _span(start, end):
+        return (end - start) * 1000 if start is not None and end is not None else None
+
+    def breakdown(self, now=None):
+        """段階毎の時間（ミリ秒）。該当しない段階（ルート未一致など）は None"""
+        # 検証エラー（422）の場合はエンドポイントが呼ばれないため、ハンドラー終了までを検証時間とする
+        validated = self.endpoint_started if self.endpoint_started is not None else self.handler_finished
+        return {
+            "total_ms": ((now or time.perf_counter()) - self.started) * 1000,
+            "validate_ms": self._span(self.handler_started, validated),
+            "app_ms": self._span(self.endpoint_started, self.endpoint_finished),
+            "serialize_ms": self._span(self.endpoint_finished, self.handler_finished),
+            "sql_count": self.sql_count,
+            "sql_ms": self.sql_ms,
+            "pool_checkouts": self.pool_checkouts,
+            "pool_wait_ms": self.pool_wait_ms,
+        }
+
+    def server_timing(self):
+        """Server-Timing ヘッダーの値"""
+        values = self.breakdown()
+        entries = [f"total;dur={values['total_ms']:.1f}"]
+        for name in ("validate", "app", "serialize"):
+            if values[f"{name}_ms"] is not None:
+                entries.append(f"{name};dur={values[f'{name}_ms']:.1f}")
+        entries.append(f'db;dur={values["sql_ms"]:.1f};desc="{values["sql_count"]} queries"')
+        entries.append(f"pool;dur={values['pool_wait_ms']:.1f}")
+        return ", ".join(entries)
+
+
+# 計測中のリクエスト（サンプリング対象外・リクエスト外では None）
+current_timing = ContextVar("request_timing", default=None)
+
+
+def _active():
+    timing = current_timing.get()
+    # リクエスト中に作られたバックグラウンドタスクはコンテキストを引き継ぐため、応答後の計上は無視する
+    return None if timing is None or timing.finished else timing
+
+
+def observe_pool_wait(wait_ms):
+    """接続プールの貸し出し待ち時間を計測中のリクエストに加算する（pool.instrumented_pool から呼ぶ）"""
+    timing = _active()
+    if timing is not None:
+        timing.pool_checkouts += 1
+        timing.pool_wait_ms += wait_ms
+
+
+def attach(engine):
+    """エンジンにSQL実行時間のイベントフックを登録する（REQUEST_TIMING=0 の場合は何もしない）"""
+    if not REQUEST_TIMING_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _active() is not None:
+            conn.info.setdefault("request_timing_started", []).append(time.perf_counter())
+
+    def finish(conn):
+        started = conn.info.get("request_timing_started")
+        timing = _active()
+        if not started or timing is None:
+            return
+        timing.sql_count += 1
+        timing.sql_ms += (time.perf_counter() - started.pop()) * 1000
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        finish(conn)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None:
+            finish(context.connection)
+
+
+def _timed_endpoint(endpoint):
+    """エンドポイント関数の開始・終了時刻を記録するラッパー（シグネチャは functools.wraps で引き継ぐ）"""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            timing = current_timing.get()
+            if timing is None:
+                return await endpoint(*args, **kwargs)
+            timing.endpoint_started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                timing.endpoint_finished = time.perf_counter()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            timing = current_timing.get()
+            if timing is None:
+                return endpoint(*args, **kwargs)
+            timing.endpoint_started = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                timing.endpoint_finished = time.perf_counter()
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    検証・エンドポイント実行・シリアライズの境界を記録するルート
+    app.router.route_class に設定する（ルート登録より前に設定すること）
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timing = current_timing.get()
+            if timing is None:
+                return await handler(request)
+            timing.handler_started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                timing.handler_finished = time.perf_counter()
+
+        return timed_handler
+
+
+class RequestTimingMiddleware:
+    """
+    サンプリングしたリクエストの処理時間の内訳を Server-Timing ヘッダーと構造化ログで出力する ASGI ミドルウェア
+    ログはレスポンス送信完了後に出力する（total_ms はボディ送信まで含む）
+    """
+
+    def __init__(self, app, sample_rate=None):
+        self.app = app
+        self.sample_rate = REQUEST_TIMING_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timing.finished = True
+            current_timing.reset(token)
+            route = scope.get("route")
+            values = {
+                name: round(value, 3) if isinstance(value, float) else value
+                for name, value in timing.breakdown().items()
+            }
+            logger.info(json.dumps({
+                "event": "request_timing",
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "route": getattr(route, "path", None),
+                "status": status,
+                **values,
+            }))
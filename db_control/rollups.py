@@ -0,0 +1,330 @@
+# db_control/rollups.py
+"""
+売上集計（ロールアップ）テーブルの増分更新・再構築・参照
+
+統計APIは取引・取引明細の全行を毎回 COUNT/SUM/GROUP BY する代わりに、
+店舗×時間 / 店舗×日 / 店舗×日×商品 の集計行を合算して応答する。
+集計行数は期間の長さにのみ比例し、取引の蓄積量には依存しない。
+
+SALES_ROLLUPS=1 で有効化する。有効化の前にテーブル作成と再構築を行うこと:
+    python -m db_control.rollups
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update, insert, delete
+
+from .models import (
+    Transaction, TransactionDetail,
+    SalesHourly, SalesDaily, ProductSalesDaily
+)
+
+
+SALES_ROLLUPS_ENABLED = os.getenv('SALES_ROLLUPS', '0') == '1'
+
+ONE_HOUR = timedelta(hours=1)
+ONE_DAY = timedelta(days=1)
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt):
+    return datetime.combine(dt.date(), datetime.min.time())
+
+
+# ===== 増分更新 =====
+
+def _upsert_add(db, model, rows, key_columns, value_columns):
+    """
+    集計行に値を加算する（行が無ければ作成）
+    MySQL は INSERT ... ON DUPLICATE KEY UPDATE、SQLite/PostgreSQL は ON CONFLICT を使う。
+    """
+    if not rows:
+        return
+    # 同一行を更新する並行トランザクション間のデッドロックを避けるためキー順に並べる
+    rows = sorted(rows, key=lambda r: tuple(r[c] for c in key_columns))
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            {c: table.c[c] + stmt.inserted[c] for c in value_columns}
+        )
+        db.execute(stmt)
+    elif dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={c: table.c[c] + stmt.excluded[c] for c in value_columns}
+        )
+        db.execute(stmt)
+    else:
+        for row in rows:
+            result = db.execute(
+                update(table)
+                .where(*(table.c[c] == row[c] for c in key_columns))
+                .values({c: table.c[c] + row[c] for c in value_columns})
+            )
+            if result.rowcount == 0:
+                db.execute(insert(table).values(row))
+
+
+def apply_transaction(db, transaction, sign=1):
+    """
+    1取引分を集計テーブルへ反映する（sign=-1 で取り消し）
+    transaction: insert_transaction() が返す形式の辞書（details を含む）
+    """
+    trd_datetime = transaction["datetime"]
+    store_cd = transaction["store_cd"]
+    details = transaction["details"]
+
+    totals = {
+        "txn_count": sign,
+        "total_amt": sign * transaction["total_amt"],
+        "item_count": sign * len(details),
+    }
+    _upsert_add(
+        db, SalesHourly,
+        [{"store_cd": store_cd, "hour_start": floor_hour(trd_datetime), **totals}],
+        ("store_cd", "hour_start"), tuple(totals)
+    )
+    _upsert_add(
+        db, SalesDaily,
+        [{"store_cd": store_cd, "sales_date": trd_datetime.date(), **totals}],
+        ("store_cd", "sales_date"), tuple(totals)
+    )
+
+    products = defaultdict(lambda: [0, 0])
+    for d in details:
+        entry = products[(d["prd_id"], d["prd_name"])]
+        entry[0] += sign
+        entry[1] += sign * d["prd_price"]
+    _upsert_add(
+        db, ProductSalesDaily,
+        [
+            {
+                "sales_date": trd_datetime.date(),
+                "store_cd": store_cd,
+                "prd_id": prd_id,
+                "prd_name": prd_name,
+                "sales_count": count,
+                "total_sales": amount,
+            }
+            for (prd_id, prd_name), (count, amount) in products.items()
+        ],
+        ("sales_date", "store_cd", "prd_id", "prd_name"),
+        ("sales_count", "total_sales")
+    )
+
+
+# ===== 再構築 =====
+
+def rebuild_rollups(db, batch_size=10000):
+    """取引・取引明細から集計テーブルを作り直す（コミットは呼び出し側で行う）"""
+    hourly = defaultdict(lambda: [0, 0, 0])
+    daily = defaultdict(lambda: [0, 0, 0])
+    products = defaultdict(lambda: [0, 0])
+
+    headers = db.query(
+        Transaction.datetime, Transaction.store_cd, Transaction.total_amt
+    ).yield_per(batch_size)
+    for trd_datetime, store_cd, total_amt in headers:
+        for bucket in (hourly[(store_cd, floor_hour(trd_datetime))],
+                       daily[(store_cd, trd_datetime.date())]):
+            bucket[0] += 1
+            bucket[1] += total_amt
+
+    lines = db.query(
+        Transaction.datetime, Transaction.store_cd,
+        TransactionDetail.prd_id, TransactionDetail.prd_name, TransactionDetail.prd_price
+    ).join(Transaction).yield_per(batch_size)
+    for trd_datetime, store_cd, prd_id, prd_name, prd_price in lines:
+        hourly[(store_cd, floor_hour(trd_datetime))][2] += 1
+        daily[(store_cd, trd_datetime.date())][2] += 1
+        entry = products[(trd_datetime.date(), store_cd, prd_id, prd_name)]
+        entry[0] += 1
+        entry[1] += prd_price
+
+    for model in (SalesHourly, SalesDaily, ProductSalesDaily):
+        db.execute(delete(model))
+
+    def insert_rows(model, rows):
+        rows = list(rows)
+        for i in range(0, len(rows), batch_size):
+            db.execute(insert(model), rows[i:i + batch_size])
+
+    insert_rows(SalesHourly, (
+        {"store_cd": s, "hour_start": h, "txn_count": c, "total_amt": t, "item_count": n}
+        for (s, h), (c, t, n) in hourly.items()
+    ))
+    insert_rows(SalesDaily, (
+        {"store_cd": s, "sales_date": d, "txn_count": c, "total_amt": t, "item_count": n}
+        for (s, d), (c, t, n) in daily.items()
+    ))
+    insert_rows(ProductSalesDaily, (
+        {"sales_date": d, "store_cd": s, "prd_id": p, "prd_name": name,
+         "sales_count": c, "total_sales": t}
+        for (d, s, p, name), (c, t) in products.items()
+    ))
+
+    return {
+        "sales_hourly": len(hourly),
+        "sales_daily": len(daily),
+        "product_sales_daily": len(products),
+    }
+
+
+# ===== 参照 =====
+
+def rollup_range(start_date=None, end_date=None):
+    """
+    統計APIの期間指定（start_date <= datetime <= end_date）を
+    時間単位の半開区間 [lo, hi) に変換する。
+    時間の境界に揃っていない場合は集計テーブルで表せないため None を返す。
+    """
+    lo = hi = None
+    if start_date is not None:
+        if start_date != floor_hour(start_date):
+            return None
+        lo = start_date
+    if end_date is not None:
+        # MySQL の DATETIME は秒精度のため HH:59:59 までを含めば時間帯の終わりまでと同じ
+        if (end_date.minute, end_date.second) != (59, 59):
+            return None
+        hi = floor_hour(end_date) + ONE_HOUR
+    return lo, hi
+
+
+def _split_range(lo, hi):
+    """[lo, hi) を 先頭の端数時間 / 丸1日の範囲 / 末尾の端数時間 に分ける"""
+    day_lo = None
+    if lo is not None:
+        day_lo = lo if lo == floor_day(lo) else floor_day(lo) + ONE_DAY
+    day_hi = None if hi is None else floor_day(hi)
+    if day_lo is not None and day_hi is not None and day_lo >= day_hi:
+        return [(lo, hi)], None
+    hour_ranges = []
+    if lo is not None and lo < day_lo:
+        hour_ranges.append((lo, day_lo))
+    if hi is not None and day_hi < hi:
+        hour_ranges.append((day_hi, hi))
+    return hour_ranges, (day_lo, day_hi)
+
+
+def sales_totals(db, lo, hi, store_cd=None):
+    """[lo, hi) の取引件数・売上合計・明細件数"""
+    hour_ranges, day_range = _split_range(lo, hi)
+    totals = [0, 0, 0]
+
+    def add(query):
+        row = query.first()
+        for i, value in enumerate(row):
+            totals[i] += int(value or 0)
+
+    for h_lo, h_hi in hour_ranges:
+        query = db.query(
+            func.sum(SalesHourly.txn_count),
+            func.sum(SalesHourly.total_amt),
+            func.sum(SalesHourly.item_count)
+        ).filter(SalesHourly.hour_start >= h_lo, SalesHourly.hour_start < h_hi)
+        if store_cd:
+            query = query.filter(SalesHourly.store_cd == store_cd)
+        add(query)
+
+    if day_range is not None:
+        d_lo, d_hi = day_range
+        query = db.query(
+            func.sum(SalesDaily.txn_count),
+            func.sum(SalesDaily.total_amt),
+            func.sum(SalesDaily.item_count)
+        )
+        if d_lo is not None:
+            query = query.filter(SalesDaily.sales_date >= d_lo.date())
+        if d_hi is not None:
+            query = query.filter(SalesDaily.sales_date < d_hi.date())
+        if store_cd:
+            query = query.filter(SalesDaily.store_cd == store_cd)
+        add(query)
+
+    return {"count": totals[0], "total": totals[1], "items": totals[2]}
+
+
+def top_products(db, lo, hi, limit, store_cd=None):
+    """
+    [lo, hi) の売れ筋商品（日単位に揃っていない期間は None を返す）
+    """
+    if (lo is not None and lo != floor_day(lo)) or (hi is not None and hi != floor_day(hi)):
+        return None
+    sales_count = func.sum(ProductSalesDaily.sales_count)
+    query = db.query(
+        ProductSalesDaily.prd_id,
+        ProductSalesDaily.prd_name,
+        sales_count.label('sales_count'),
+        func.sum(ProductSalesDaily.total_sales).label('total_sales')
+    )
+    if lo is not None:
+        query = query.filter(ProductSalesDaily.sales_date >= lo.date())
+    if hi is not None:
+        query = query.filter(ProductSalesDaily.sales_date < hi.date())
+    if store_cd:
+        query = query.filter(ProductSalesDaily.store_cd == store_cd)
+    return query.group_by(
+        ProductSalesDaily.prd_id,
+        ProductSalesDaily.prd_name
+    ).having(sales_count > 0).order_by(sales_count.desc()).limit(limit).all()
+
+
+def hourly_sales(db, lo, hi):
+    """[lo, hi) の時間帯別 取引件数・売上合計（全店舗合算、時間帯の昇順）"""
+    rows = db.query(
+        SalesHourly.hour_start,
+        func.sum(SalesHourly.txn_count).label('count'),
+        func.sum(SalesHourly.total_amt).label('total')
+    ).filter(
+        SalesHourly.hour_start >= lo,
+        SalesHourly.hour_start < hi
+    ).group_by(SalesHourly.hour_start).order_by(SalesHourly.hour_start).all()
+    return [row for row in rows if row.count]
+
+
+def main():
+    """集計テーブルを作成して再構築する"""
+    from .connection import engine, SessionLocal
+
+    print("=" * 60)
+    print("📊 売上集計テーブル再構築開始")
+    print("=" * 60)
+
+    for model in (SalesHourly, SalesDaily, ProductSalesDaily):
+        model.__table__.create(bind=engine, checkfirst=True)
+
+    session = SessionLocal()
+    try:
+        counts = rebuild_rollups(session)
+        session.commit()
+        for table, count in counts.items():
+            print(f"   - {table}: {count}行")
+        print("✅ 売上集計テーブルの再構築に成功しました")
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"❌ 再構築エラー: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# db_control/search_index.py
+"""
+商品の部分一致検索用インデックス
+
+LIKE '%x%' は B-tree インデックスが使えず product_master を全件走査するため、
+商品コードと商品名称の索引をプロセス内に持って検索する（PRODUCT_SEARCH_INDEX=1 で有効化）。
+  - 商品コード: ソート済みのコード列に対する前方一致（二分探索、コード順）
+  - 商品名称: 1-gram / 2-gram の出現位置ごとの転置リスト（int 配列）
+
+名称の転置リストは あらかじめ (名称の長さ, prd_id) 順に並べてあるため、ランキング
+（コード前方一致 → 名称の一致位置が前 → 名称が短い順）の上位 k 件は候補全体を
+走査・ソートせずに先頭から k 件読むだけで求まる。コードの途中一致（例: 末尾4桁）は対象外。
+
+構築・定期的な再構築はバックグラウンドで行う。構築後の登録・更新・削除は小さな差分として保持し、
+検索時に合わせて評価する（次の再構築で索引に取り込む）。
+"""
+
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from .models import ProductMaster
+
+
+def normalize(text):
+    """検索用の正規化（全角/半角・大文字/小文字の揺れを吸収）"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def _row(product):
+    """索引に持つ1商品分の値 (コード, 名称, 単価, 正規化コード, 正規化名称)"""
+    code, name = product["code"], product["name"]
+    norm_code, norm_name = normalize(code), normalize(name)
+    # 正規化で変わらない場合は元の文字列を共有してメモリを節約する
+    return (
+        code, name, product["price"],
+        code if norm_code == code else norm_code,
+        name if norm_name == name else norm_name,
+    )
+
+
+def _to_dict(prd_id, row):
+    return {"prd_id": prd_id, "code": row[0], "name": row[1], "price": row[2]}
+
+
+def _match_key(prd_id, row, term):
+    """1商品のランキングキー（一致しない場合は None）"""
+    if row[3].startswith(term):
+        return (1, row[3], prd_id)
+    pos = row[4].find(term)
+    if pos < 0:
+        return None
+    return (2, pos, len(row[4]), prd_id)
+
+
+class _Segment:
+    """一括構築した読み取り専用の索引"""
+
+    __slots__ = ("rows", "codes", "code_ids", "postings", "sizes")
+
+    def __init__(self, products=()):
+        self.rows = {}      # prd_id -> _row()
+        self.codes = []     # ソート済みの正規化コード
+        self.code_ids = array('q')
+        self.postings = {}  # n-gram -> ((出現位置, array[prd_id]), ...)  各配列は (名称の長さ, prd_id) 順
+        self.sizes = {}     # n-gram -> 転置リストの総件数
+
+        for product in products:
+            self.rows[product["prd_id"]] = _row(product)
+
+        pairs = sorted((row[3], prd_id) for prd_id, row in self.rows.items())
+        self.codes = [code for code, _ in pairs]
+        self.code_ids = array('q', (prd_id for _, prd_id in pairs))
+
+        buckets = {}  # (n-gram, 出現位置) -> [prd_id]
+        for prd_id in sorted(self.rows, key=lambda i: (len(self.rows[i][4]), i)):
+            name = self.rows[prd_id][4]
+            for pos in range(len(name)):
+                buckets.setdefault((name[pos], pos), []).append(prd_id)
+                if pos + 1 < len(name):
+                    buckets.setdefault((name[pos:pos + 2], pos), []).append(prd_id)
+
+        grouped = {}
+        for (gram, pos), ids in buckets.items():
+            grouped.setdefault(gram, []).append((pos, array('q', ids)))
+            self.sizes[gram] = self.sizes.get(gram, 0) + len(ids)
+        self.postings = {gram: tuple(sorted(lists, key=lambda item: item[0])) for gram, lists in grouped.items()}
+
+    def matches(self, term):
+        """ランキング順の (キー...) を生成する（同じ商品がコード・名称の両方で出ることがある）"""
+        codes, code_ids = self.codes, self.code_ids
+        i = bisect_left(codes, term)
+        while i < len(codes) and codes[i].startswith(term):
+            yield (1, codes[i], code_ids[i])
+            i += 1
+
+        # 名称: 検索語の中で最も出現の少ない n-gram の転置リストを使う
+        if len(term) == 1:
+            offset, gram = 0, term
+        else:
+            offset, gram = min(
+                ((j, term[j:j + 2]) for j in range(len(term) - 1)),
+                key=lambda item: self.sizes.get(item[1], 0)
+            )
+        rows = self.rows
+        for pos, ids in self.postings.get(gram, ()):
+            start = pos - offset
+            if start < 0:
+                continue
+            for prd_id in ids:
+                name = rows[prd_id][4]
+                if name.find(term) == start:  # 最初の一致位置の転置リストでのみ採用する
+                    yield (2, start, len(name), prd_id)
+
+
+class ProductSearchIndex:
+    """商品コード（前方一致）・商品名称（部分一致）の検索インデックス"""
+
+    def __init__(self, refresh_interval=300.0):
+        self.refresh_interval = refresh_interval
+        self._segment = _Segment()
+        self._overlay = {}     # 構築後に登録・更新された商品 prd_id -> _row()
+        self._dirty = set()    # 構築後に登録・更新・削除された prd_id（索引側の値は使わない）
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._changes = None  # 構築中に反映された登録・更新・削除（構築後に再適用する）
+
+    @property
+    def ready(self):
+        return self._built_at is not None
+
+    # ----- 構築・更新 -----
+
+    def build(self, db):
+        """
+        DB から全商品を読み込んでインデックスを再構築する（ブロッキング、バックグラウンドで呼ぶ）
+        新しいインデックスはロックの外で作り、完成後に差し替える（構築中も検索できる）
+        """
+        with self._lock:
+            self._changes = []
+        try:
+            rows = db.query(
+                ProductMaster.prd_id,
+                ProductMaster.code,
+                ProductMaster.name,
+                ProductMaster.price
+            ).all()
+            segment = _Segment(row._asdict() for row in rows)
+            del rows
+            with self._lock:
+                self._segment = segment
+                self._overlay, self._dirty = {}, set()
+                for change in self._changes:
+                    self._apply(change)
+                self._built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def _apply(self, change):
+        prd_id = change["prd_id"]
+        self._dirty.add(prd_id)
+        if "code" in change:
+            self._overlay[prd_id] = _row(change)
+        else:
+            self._overlay.pop(prd_id, None)
+
+    def upsert(self, product):
+        """商品の登録・更新を反映する（未構築の場合は何もしない）"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(product)
+            if self._built_at is not None:
+                self._apply(product)
+
+    def remove(self, prd_id):
+        """商品の削除を反映する"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append({"prd_id": prd_id})
+            if self._built_at is not None:
+                self._apply({"prd_id": prd_id})
+
+    # ----- 検索 -----
+
+    def search(self, text, offset=0, limit=100):
+        """
+        部分一致検索（ブロッキング。イベントループからはスレッドで呼ぶ）
+        リターン: (offset から limit 件のランキング順の商品辞書リスト, 続きがあるか)
+        （コード前方一致（コード順） → 名称の一致位置が前 → 名称が短い順）
+        """
+        term = normalize(text)
+        if not term:
+            return [], False
+
+        with self._lock:
+            segment, overlay, dirty = self._segment, dict(self._overlay), set(self._dirty)
+
+        extra = sorted(
+            key for key in (_match_key(prd_id, row, term) for prd_id, row in overlay.items())
+            if key is not None
+        )
+        # 構築後に更新・削除された商品は索引側の古い値を使わない（更新後の値は差分側で評価済み）
+        indexed = (key for key in segment.matches(term) if key[-1] not in dirty)
+        need = offset + limit + 1  # 続きの有無を判定するため1件多く求める
+        found, seen = [], set()
+        for key in heapq.merge(indexed, extra):
+            prd_id = key[-1]
+            if prd_id in seen:
+                continue
+            seen.add(prd_id)
+            found.append(prd_id)
+            if len(found) >= need:
+                break
+
+        page = [
+            _to_dict(prd_id, overlay[prd_id] if prd_id in overlay else segment.rows[prd_id])
+            for prd_id in found[offset:offset + limit]
+        ]
+        return page, len(found) > offset + limit
+
+    def stats(self):
+        """インデックスの統計情報"""
+        with self._lock:
+            segment = self._segment
+            return {
+                "products": len(segment.rows) + sum(1 for i in self._overlay if i not in segment.rows),
+                "ngrams": len(segment.postings),
+                "pending_changes": len(self._dirty),
+                "built": self._built_at is not None,
+                "age_seconds": round(time.monotonic() - self._built_at, 1) if self._built_at else None,
+                "refresh_interval_seconds": self.refresh_interval,
+            }
+
+
+# 商品検索インデックス（PRODUCT_SEARCH_INDEX=1 で有効化、既定は従来の LIKE 検索）
+PRODUCT_SEARCH_INDEX_ENABLED = os.getenv('PRODUCT_SEARCH_INDEX', '0') == '1'
+
+product_search_index = ProductSearchIndex(
+    refresh_interval=float(os.getenv('PRODUCT_SEARCH_INDEX_REFRESH', '300')),
+)
@@ -0,0 +1,160 @@
+# db_control/sql_log.py
+"""
+SQLの実行ログと実行時間の集計
+
+create_engine(echo=True) は全SQLとパラメータを同期的に整形・出力するため、
+本番のリクエスト処理に負荷がかかる。代わりにエンジンのイベントフックで
+  - サンプリングした一部のSQLのみ出力（SQL_LOG_SAMPLE_RATE）
+  - しきい値を超えたSQLをスロークエリとして出力（SQL_SLOW_QUERY_MS）
+  - リテラルを除いたSQLの形（フィンガープリント）ごとに件数・実行時間を集計
+を行う。SQL_LOG=0 でフックごと無効化する。
+"""
+
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import event
+
+
+SQL_LOG_ENABLED = os.getenv('SQL_LOG', '1') == '1'
+SQL_LOG_SAMPLE_RATE = float(os.getenv('SQL_LOG_SAMPLE_RATE', '0'))
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '500'))
+SQL_STATS_MAX_FINGERPRINTS = int(os.getenv('SQL_STATS_MAX_FINGERPRINTS', '500'))
+
+# 開発用: 従来どおり echo で全SQLを出力する
+SQL_ECHO = os.getenv('SQL_ECHO', '0') == '1'
+
+# 集計対象の種類数が上限を超えた場合にまとめるキー
+OTHER_FINGERPRINT = "<other>"
+
+logger = logging.getLogger("pos.sql")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [sql] %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_VALUES_ROWS = re.compile(r"(\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """
+    SQLからリテラル・プレースホルダ列を除いた形を返す
+    例: SELECT ... WHERE prd_id IN (%s, %s, %s) -> SELECT ... WHERE prd_id IN (?...)
+    """
+    text = _SPACE.sub(" ", statement).strip()
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(?...)", text)
+    return _VALUES_ROWS.sub(r"\1", text)
+
+
+def _truncate(value, limit=500):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class SQLStats:
+    """フィンガープリント毎の実行件数・実行時間（スレッドセーフ）"""
+
+    def __init__(self, max_fingerprints=500):
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}  # fingerprint -> [count, total_ms, max_ms, errors]
+            self.slow_queries = 0
+            self.sampled = 0
+
+    def observe(self, statement, elapsed_ms, error=False):
+        key = fingerprint(statement)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    key = OTHER_FINGERPRINT
+                entry = self._stats.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            entry[2] = max(entry[2], elapsed_ms)
+            if error:
+                entry[3] += 1
+
+    def stats(self, limit=20, order_by="total_ms"):
+        """合計実行時間（または件数・最大時間）の大きい順に上位 limit 件"""
+        with self._lock:
+            rows = [
+                {
+                    "fingerprint": key,
+                    "count": count,
+                    "total_ms": round(total, 3),
+                    "average_ms": round(total / count, 3) if count else 0.0,
+                    "max_ms": round(maximum, 3),
+                    "errors": errors,
+                }
+                for key, (count, total, maximum, errors) in self._stats.items()
+            ]
+            summary = {
+                "enabled": SQL_LOG_ENABLED,
+                "sample_rate": SQL_LOG_SAMPLE_RATE,
+                "slow_query_ms": SQL_SLOW_QUERY_MS,
+                "fingerprints": len(rows),
+                "statements": sum(row["count"] for row in rows),
+                "slow_queries": self.slow_queries,
+                "sampled": self.sampled,
+            }
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return {**summary, "top": rows[:limit]}
+
+
+sql_stats = SQLStats(max_fingerprints=SQL_STATS_MAX_FINGERPRINTS)
+
+
+def _finish(conn, statement, parameters, error=False):
+    started = conn.info.get("sql_log_started")
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    sql_stats.observe(statement, elapsed_ms, error)
+
+    if elapsed_ms >= SQL_SLOW_QUERY_MS:
+        with sql_stats._lock:
+            sql_stats.slow_queries += 1
+        logger.warning("slow query %.1fms: %s params=%s", elapsed_ms, statement, _truncate(parameters))
+    elif SQL_LOG_SAMPLE_RATE > 0 and random.random() < SQL_LOG_SAMPLE_RATE:
+        with sql_stats._lock:
+            sql_stats.sampled += 1
+        logger.info("%.1fms: %s params=%s", elapsed_ms, statement, _truncate(parameters))
+
+
+def attach(engine):
+    """エンジンにSQLログ・集計のイベントフックを登録する（SQL_LOG=0 の場合は何もしない）"""
+    if not SQL_LOG_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("sql_log_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _finish(conn, statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.statement is not None:
+            _finish(context.connection, context.statement, context.parameters, error=True)
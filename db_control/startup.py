@@ -0,0 +1,74 @@
+# db_control/startup.py
+"""
+起動時間の計測
+
+gunicorn はワーカーを max_requests ごとに作り直すため、起動にかかる時間は
+繰り返し発生する。モジュール読み込み・エンジン作成・最初の接続・lifespan・
+最初のリクエスト応答までの内訳を記録し、起動時に1行で出力する。
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """起動処理の段階ごとの所要時間（ミリ秒）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.worker_started = None
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name, seconds):
+        with self._lock:
+            self.marks.setdefault(name, round(seconds * 1000, 3))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - started)
+
+    def start_worker(self):
+        """ワーカーの起動処理（lifespan）の開始を記録する"""
+        self.worker_started = time.perf_counter()
+
+    def mark_since_worker_start(self, name):
+        if self.worker_started is not None:
+            self.mark(name, time.perf_counter() - self.worker_started)
+
+    def watch_first_connect(self, engine):
+        """エンジンの最初の接続確立までの時間を記録する"""
+        from sqlalchemy import event
+
+        created = time.perf_counter()
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.mark("first_connection", time.perf_counter() - created)
+
+    def report(self):
+        return {"pid": os.getpid(), **self.marks}
+
+    def summary(self):
+        return " ".join(f"{name}={ms:.0f}ms" for name, ms in self.marks.items())
+
+
+startup_timer = StartupTimer()
+
+
+class FirstRequestTimer:
+    """最初のHTTPリクエストへの応答完了時刻を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and "first_request" not in startup_timer.marks:
+            startup_timer.mark_since_worker_start("first_request")
@@ -0,0 +1,67 @@
+# db_control/statements.py
+"""
+高頻度に実行するSQL文（商品検索・購入登録）
+
+db.query(ProductMaster).filter(...) はリクエストのたびにクエリオブジェクトを組み立て、
+キャッシュキーを計算し、ORM エンティティへの変換を行う。バーコードスキャンと購入は
+最も実行回数が多いため、文をモジュール読み込み時に一度だけ作り、値は bindparam で渡す。
+作成済みの文はキャッシュキーが保持されるため、コンパイル済みSQLのキャッシュを直接引ける。
+結果はORMオブジェクトではなく列の辞書で返す。
+
+PyMySQL / aiomysql はサーバーサイドのプリペアドステートメントに対応していないため、
+パラメータはクライアント側で埋め込まれる（ここで省けるのは Python 側の組み立てとコンパイル）。
+"""
+
+from sqlalchemy import select, insert, bindparam
+
+from .models import ProductMaster, Transaction, TransactionDetail
+
+
+PRODUCT_COLUMNS = (
+    ProductMaster.prd_id,
+    ProductMaster.code,
+    ProductMaster.name,
+    ProductMaster.price,
+)
+
+PRODUCT_BY_CODE = select(*PRODUCT_COLUMNS).where(
+    ProductMaster.code == bindparam("code")
+).limit(1)
+
+PRODUCT_BY_ID = select(*PRODUCT_COLUMNS).where(
+    ProductMaster.prd_id == bindparam("prd_id")
+)
+
+PRODUCTS_BY_CODES = select(*PRODUCT_COLUMNS).where(
+    ProductMaster.code.in_(bindparam("codes", expanding=True))
+)
+
+EXISTING_PRODUCT_IDS = select(ProductMaster.prd_id).where(
+    ProductMaster.prd_id.in_(bindparam("prd_ids", expanding=True))
+)
+
+# ORM の一括 INSERT 処理を経由しないよう、テーブルに対する Core の INSERT にする
+INSERT_TRANSACTION = insert(Transaction.__table__)
+INSERT_TRANSACTION_DETAILS = insert(TransactionDetail.__table__)
+
+
+def fetch_product_by_code(db, code):
+    """商品コードで商品を取得する（見つからない場合は None）"""
+    row = db.execute(PRODUCT_BY_CODE, {"code": code}).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def fetch_product_by_id(db, prd_id):
+    """商品IDで商品を取得する（見つからない場合は None）"""
+    row = db.execute(PRODUCT_BY_ID, {"prd_id": prd_id}).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def fetch_products_by_codes(db, codes):
+    """商品コードのリストに一致する商品を取得する（1クエリ）"""
+    return [dict(row) for row in db.execute(PRODUCTS_BY_CODES, {"codes": list(codes)}).mappings()]
+
+
+def fetch_existing_product_ids(db, prd_ids):
+    """存在する商品IDの集合を返す（1クエリ）"""
+    return set(db.execute(EXISTING_PRODUCT_IDS, {"prd_ids": list(prd_ids)}).scalars())
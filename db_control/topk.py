@@ -0,0 +1,326 @@
+# db_control/topk.py
+"""
+売れ筋商品のストリーミング Top-K（Space-Saving）
+
+ダッシュボードが頻繁に問い合わせる売れ筋ランキングを、取引明細の GROUP BY ではなく
+プロセス内の Space-Saving サマリーから応答する。サマリーは 店舗×日 と 店舗×全期間 の
+単位で持ち、購入処理から更新し、起動時にDBから初期化する。
+
+Space-Saving の販売数は過大評価のみで、各商品の誤差は max_error 以下。
+サマリーが一度も追い出しをしていなければ結果は厳密（exact）になる。
+ただしワーカーが複数ある場合、各ワーカーのサマリーは自ワーカーの購入しか反映しないため
+TOPK_RESEED_SECONDS ごとに前回以降の取引（trd_id が取り込み済みの位置より後）だけをDBから読んで取り込み、
+結果は常に近似（exact=False）として扱う。他ワーカーでの取引削除は TOPK_FULL_RESEED_SECONDS ごとの
+作り直しで反映する。
+"""
+
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from .models import Transaction, TransactionDetail
+from .pool import worker_count
+
+
+class SpaceSaving:
+    """Space-Saving 頻出要素サマリー"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}  # key -> [count, error, total_sales]
+        self.evicted = False
+
+    def offer(self, key, count=1, amount=0):
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] += count
+            entry[2] += amount
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0, amount]
+            return
+        # 最小カウンタを追い出して引き継ぐ（誤差 = 引き継いだカウント）
+        min_key = min(self.counters, key=lambda k: self.counters[k][0])
+        min_count = self.counters.pop(min_key)[0]
+        self.counters[key] = [min_count + count, min_count, amount]
+        self.evicted = True
+
+    def load(self, totals):
+        """
+        厳密な集計値から初期化する
+        totals: key -> (count, total_sales)。上位 capacity 件のみ保持する
+        """
+        ranked = sorted(totals.items(), key=lambda item: -item[1][0])
+        self.counters = {
+            key: [count, 0, amount] for key, (count, amount) in ranked[:self.capacity]
+        }
+        self.evicted = len(ranked) > self.capacity
+
+    def retract(self, key, count=1, amount=0):
+        """取引削除の反映（追跡中の商品のみ減算できる）"""
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] = max(entry[0] - count, 0)
+            entry[2] -= amount
+
+    def threshold(self):
+        """追跡していない商品の販売数の上限"""
+        if not self.evicted:
+            return 0
+        return min(entry[0] for entry in self.counters.values())
+
+
+def merge_top(sketches, limit):
+    """
+    複数のサマリーを合算して上位を返す
+    リターン: ([(key, count, max_error, total_sales), ...], exact)
+    """
+    sketches = list(sketches)
+    thresholds = [s.threshold() for s in sketches]
+    keys = set()
+    for s in sketches:
+        keys.update(s.counters)
+
+    merged = []
+    for key in keys:
+        count = error = amount = 0
+        for s, threshold in zip(sketches, thresholds):
+            entry = s.counters.get(key)
+            if entry is None:
+                count += threshold
+                error += threshold
+            else:
+                count += entry[0]
+                error += entry[1]
+                amount += entry[2]
+        if count > 0:
+            merged.append((key, count, error, amount))
+
+    merged.sort(key=lambda r: (-r[1], r[0]))
+    exact = not any(s.evicted for s in sketches)
+    return merged[:limit], exact
+
+
+class TopProductsTracker:
+    """店舗×日 / 店舗×全期間 の売れ筋サマリーを管理する"""
+
+    def __init__(self, capacity=1000, retention_days=35, shared=False, overlap=1000):
+        self.capacity = capacity
+        self.retention_days = retention_days
+        self.shared = shared  # 他ワーカーも購入を処理する（サマリーに他ワーカー分の漏れがある）
+        # 採番順とコミット順の前後に備え、取り込み済みの最大 trd_id から overlap 件前までは取引毎に記録する
+        self.overlap = overlap
+        self._daily = {}     # (date, store_cd) -> SpaceSaving
+        self._all_time = {}  # store_cd -> SpaceSaving
+        self._lock = threading.Lock()
+        self._watermark = None  # これ以下の trd_id は反映済み（初期化前は None）
+        self._seen = set()      # _watermark より後で反映済みの trd_id
+        self._pending = []      # 初期化完了前・再初期化中に届いた取引
+        self._seeding = False
+        self.seeded_at = None
+        self.caught_up_at = None
+
+    @property
+    def ready(self):
+        return self._watermark is not None
+
+    def _sketch(self, table, key):
+        sketch = table.get(key)
+        if sketch is None:
+            sketch = table[key] = SpaceSaving(self.capacity)
+        return sketch
+
+    def _apply(self, transaction, sign):
+        day = transaction["datetime"].date()
+        store_cd = transaction["store_cd"]
+        sketches = (
+            self._sketch(self._daily, (day, store_cd)),
+            self._sketch(self._all_time, store_cd),
+        )
+        for d in transaction["details"]:
+            key = (d["prd_id"], d["prd_name"])
+            for sketch in sketches:
+                if sign > 0:
+                    sketch.offer(key, 1, d["prd_price"])
+                else:
+                    sketch.retract(key, 1, d["prd_price"])
+
+    def record(self, transaction, sign=1):
+        """取引（details を含む辞書）を反映する（sign=-1 で取り消し）"""
+        with self._lock:
+            if self._watermark is None:
+                self._pending.append((transaction, sign))
+                return
+            if self._seeding:
+                # 再初期化のDB集計に含まれない可能性があるため、完了後にも反映し直す
+                self._pending.append((transaction, sign))
+            if sign > 0:
+                if not self._mark_seen(transaction["trd_id"]):
+                    return  # 初期化・取り込み時に集計済み
+            self._apply(transaction, sign)
+            self._expire()
+
+    def _mark_seen(self, trd_id):
+        """未反映の取引なら反映済みとして記録して True を返す"""
+        if trd_id <= self._watermark or trd_id in self._seen:
+            return False
+        self._seen.add(trd_id)
+        return True
+
+    def _expire(self):
+        oldest = date.today() - timedelta(days=self.retention_days)
+        for key in [k for k in self._daily if k[0] < oldest]:
+            del self._daily[key]
+
+    def seed(self, db):
+        """DBから初期化する（保持期間分の日別と全期間）。再初期化中の取引は完了後に反映する"""
+        with self._lock:
+            self._seeding = True
+        try:
+            self._seed(db)
+        finally:
+            with self._lock:
+                self._seeding = False
+
+    def catch_up(self, db):
+        """
+        前回の初期化・取り込み以降の取引（他ワーカーの購入を含む）をDBから読んで反映する
+        読み込むのは取り込み済みの位置より後の取引明細だけで、既に反映した取引は除く
+        """
+        with self._lock:
+            if self._watermark is None:
+                return 0
+            low = self._watermark
+
+        rows = db.query(
+            Transaction.trd_id, Transaction.datetime, Transaction.store_cd,
+            TransactionDetail.prd_id, TransactionDetail.prd_name, TransactionDetail.prd_price
+        ).join(Transaction).filter(Transaction.trd_id > low).order_by(Transaction.trd_id).all()
+
+        transactions = {}
+        for trd_id, trd_datetime, store_cd, prd_id, prd_name, prd_price in rows:
+            transaction = transactions.setdefault(
+                trd_id, {"trd_id": trd_id, "datetime": trd_datetime, "store_cd": store_cd, "details": []}
+            )
+            transaction["details"].append({"prd_id": prd_id, "prd_name": prd_name, "prd_price": prd_price})
+
+        with self._lock:
+            if self._watermark is None or self._watermark < low:
+                return 0  # 取り込み中に作り直された
+            applied = 0
+            for trd_id, transaction in transactions.items():
+                if self._mark_seen(trd_id):
+                    self._apply(transaction, 1)
+                    applied += 1
+            self._expire()
+            # 取り込み済みの位置を進め、それ以前の記録を捨てる
+            if self._seen:
+                self._watermark = max(self._watermark, max(self._seen) - self.overlap)
+                self._seen = {trd_id for trd_id in self._seen if trd_id > self._watermark}
+            self.caught_up_at = time.monotonic()
+            return applied
+
+    def _seed(self, db):
+        watermark = db.query(func.max(Transaction.trd_id)).scalar() or 0
+        since = date.today() - timedelta(days=self.retention_days)
+        sales_day = func.date(Transaction.datetime)
+
+        base = db.query(
+            Transaction.store_cd,
+            TransactionDetail.prd_id,
+            TransactionDetail.prd_name,
+            func.count(TransactionDetail.prd_id),
+            func.sum(TransactionDetail.prd_price)
+        ).join(Transaction).filter(Transaction.trd_id <= watermark)
+
+        all_time = base.group_by(
+            Transaction.store_cd, TransactionDetail.prd_id, TransactionDetail.prd_name
+        ).all()
+        daily = base.add_columns(sales_day).filter(
+            Transaction.datetime >= since
+        ).group_by(
+            sales_day, Transaction.store_cd, TransactionDetail.prd_id, TransactionDetail.prd_name
+        ).all()
+
+        all_time_totals = {}
+        for store_cd, prd_id, prd_name, count, amount in all_time:
+            all_time_totals.setdefault(store_cd, {})[(prd_id, prd_name)] = (count, int(amount or 0))
+        daily_totals = {}
+        for store_cd, prd_id, prd_name, count, amount, day in daily:
+            if isinstance(day, str):
+                day = date.fromisoformat(day)
+            daily_totals.setdefault((day, store_cd), {})[(prd_id, prd_name)] = (count, int(amount or 0))
+
+        with self._lock:
+            self._daily.clear()
+            self._all_time.clear()
+            for store_cd, totals in all_time_totals.items():
+                self._sketch(self._all_time, store_cd).load(totals)
+            for key, totals in daily_totals.items():
+                self._sketch(self._daily, key).load(totals)
+            self._watermark = watermark
+            self._seen = set()
+            self.seeded_at = self.caught_up_at = time.monotonic()
+            self._seeding = False
+            pending, self._pending = self._pending, []
+            for transaction, sign in pending:
+                if transaction["trd_id"] > watermark and (sign < 0 or self._mark_seen(transaction["trd_id"])):
+                    self._apply(transaction, sign)
+
+    def top(self, limit, first_day=None, last_day=None, store_cd=None):
+        """
+        売れ筋上位（first_day〜last_day、両端含む。両方 None で全期間）
+        保持期間外などサマリーで応答できない場合は None を返す
+        """
+        with self._lock:
+            if self._watermark is None:
+                return None
+            if first_day is None and last_day is None:
+                sketches = [s for k, s in self._all_time.items() if store_cd in (None, k)]
+            else:
+                oldest = date.today() - timedelta(days=self.retention_days)
+                if first_day is None or first_day < oldest:
+                    return None
+                last_day = last_day or date.today()
+                sketches = [
+                    s for (day, store), s in self._daily.items()
+                    if first_day <= day <= last_day and store_cd in (None, store)
+                ]
+            results, exact = merge_top(sketches, limit)
+            return results, exact and not self.shared
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self._watermark is not None,
+                "shared": self.shared,
+                "seeded_seconds_ago": round(time.monotonic() - self.seeded_at, 3) if self.seeded_at else None,
+                "caught_up_seconds_ago": round(time.monotonic() - self.caught_up_at, 3) if self.caught_up_at else None,
+                "watermark": self._watermark,
+                "capacity": self.capacity,
+                "retention_days": self.retention_days,
+                "daily_sketches": len(self._daily),
+                "all_time_sketches": len(self._all_time),
+                "approximate_sketches": sum(
+                    1 for s in list(self._daily.values()) + list(self._all_time.values()) if s.evicted
+                ),
+            }
+
+
+# TOPK_TRACKER=1 で有効化（売れ筋ランキングをサマリーから応答）
+TOPK_TRACKER_ENABLED = os.getenv('TOPK_TRACKER', '0') == '1'
+
+# 他ワーカーの購入を取り込む間隔（秒、0 で無効）。前回以降の取引だけを読み込む
+TOPK_RESEED_SECONDS = float(os.getenv('TOPK_RESEED_SECONDS', '60'))
+
+# 他ワーカーでの取引削除を反映するためにDBから作り直す間隔（秒）
+TOPK_FULL_RESEED_SECONDS = float(os.getenv('TOPK_FULL_RESEED_SECONDS', '3600'))
+
+top_products_tracker = TopProductsTracker(
+    capacity=int(os.getenv('TOPK_CAPACITY', '1000')),
+    retention_days=int(os.getenv('TOPK_RETENTION_DAYS', '35')),
+    shared=worker_count() > 1,
+)
@@ -8,7 +8,9 @@ bind = f"0.0.0.0:{port}"
 backlog = 2048
 
 # Worker processes (Azure App Service用に調整)
-workers = min(multiprocessing.cpu_count(), 2)  # Azure App Service用に制限
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 2)))  # Azure App Service用に制限
+# DB接続プールのサイズ計算に使う（db_control/pool.py）
+os.environ['GUNICORN_WORKERS'] = str(workers)
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 300  # Azure App Service用に延長
@@ -41,6 +43,12 @@ certfile = None
 # Preload application for better performance
 preload_app = True
 
+
+def post_fork(server, worker):
+    # DB接続プールはワーカー毎に作る（master で作成済みの場合は引き継がない）
+    from db_control.connection import dispose_engine_after_fork
+    dispose_engine_after_fork()
+
 # Environment variables
 raw_env = [
     f"DB_USER={os.getenv('DB_USER', '')}",
@@ -49,4 +57,5 @@ raw_env = [
     f"DB_PORT={os.getenv('DB_PORT', '3306')}",
     f"DB_NAME={os.getenv('DB_NAME', '')}",
     f"WEBSITES_PORT={port}",
+    f"GUNICORN_WORKERS={workers}",
 ]